@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of JSON handling on a `games/last` payload (runs offline)
+
+Compares what the app did before `overlay.json_codec` with what it does now:
+- decoding a response: `json.loads(resp.text)` vs `json_codec.loads(resp.content)`
+- encoding a websocket message for N clients: `json.dumps` per client vs once
+
+The payload is read from `benchmark_data/games_last_rm_4v4.json`. It can be replaced
+with a recorded response with `--record PROFILE_ID` (needs network).
+
+Usage: python benchmark_json.py [--clients 3] [--repeat 200] [--record PROFILE_ID]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import overlay.json_codec as json_codec
+from overlay.helper_func import process_game
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "benchmark_data", "games_last_rm_4v4.json")
+
+
+def record(profile_id: int):
+    """ Saves the last game of the profile as the fixture"""
+    url = f"https://aoe4world.com/api/v0/players/{profile_id}/games/last"
+    data = requests.get(url, timeout=20).json()
+    with open(FIXTURE, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+        f.write("\n")
+    print(f"Recorded {url}")
+
+
+def response(content: bytes) -> requests.Response:
+    """ A response as `requests` returns it"""
+    resp = requests.Response()
+    resp._content = content
+    resp.status_code = 200
+    resp.headers["Content-Type"] = "application/json"
+    return resp
+
+
+def best_ms(statement, repeat: int) -> float:
+    """ Best time of one call (ms)"""
+    return min(timeit.repeat(statement, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON codec micro-benchmark")
+    parser.add_argument("--clients", type=int, default=3,
+                        help="websocket clients a message is sent to")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--record", type=int, metavar="PROFILE_ID",
+                        help="record a new payload from aoe4world first")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record)
+    with open(FIXTURE, "rb") as f:
+        # Compact, as the API sends it
+        content = json.dumps(json.load(f)).encode("utf-8")
+    game = json_codec.loads(content)
+    game['leaderboard_id'] = 20
+    message = {"type": "player_data", "data": process_game(game)}
+
+    print(f"Backend: {'orjson' if json_codec.orjson else 'json'} | "
+          f"payload {len(content) / 1024:.0f} KB")
+    results = (
+        ("decode response", lambda: json.loads(response(content).text),
+         lambda: json_codec.loads(response(content).content)),
+        (f"encode message for {args.clients} clients",
+         lambda: [json.dumps(message) for _ in range(args.clients)],
+         lambda: json_codec.dumps(message)),
+    )
+    for name, before, after in results:
+        old = best_ms(before, args.repeat)
+        new = best_ms(after, args.repeat)
+        print(f"{name:<32} | before {old:7.3f} ms | after {new:7.3f} ms | "
+              f"{old / new:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Load test of the websocket server with simulated overlay clients (Linux, runs offline)
+
+Starts `Websocket_manager` on a free port, connects N clients from a separate process and pushes
+recorded `player_data` and `color` messages at given rates. Reports delivery latency percentiles,
+server CPU time per client and server memory growth.
+
+Usage: python benchmark_websocket.py [--clients 1 10 100] [--duration 10] [--player-rate 5]
+                                     [--color-rate 0.5] [--delta]
+"""
+
+import argparse
+import asyncio
+import copy
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import overlay.json_codec as json_codec
+from overlay.websocket import Websocket_manager
+
+# Processed 4v4 game as sent to the overlay
+PLAYER_DATA: Dict[str, Any] = {
+    "map": "Dry Arabia",
+    "players": [{
+        "civ": civ,
+        "name": f"Player {i}",
+        "team": 1 + i % 2,
+        "rating": str(1400 + 17 * i),
+        "rank": f"#{300 + 41 * i}",
+        "wins": str(120 + i),
+        "losses": str(100 + i),
+        "winrate": f"{54.5 - i:.1f}%",
+        "civ_games": str(40 + i),
+        "civ_winrate": f"{51.2 + i:.1f}%",
+        "civ_win_length_median": f"{22 + i}:1{i}",
+    } for i, civ in enumerate(
+        ("English", "French", "Holy Roman Empire", "Mongols", "Rus",
+         "Chinese", "Delhi Sultanate", "Abbasid Dynasty"))]
+}
+COLOR_DATA = [[74, 255, 2, 0.35], [3, 179, 255, 0.35], [255, 0, 0, 0.35],
+              [255, 0, 255, 0.35], [255, 255, 0, 0.35]]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def start_manager() -> Websocket_manager:
+    """ Starts the websocket server on a free port and waits until it runs"""
+    manager = Websocket_manager(free_port())
+    manager.run()
+    while manager.loop is None:
+        time.sleep(0.01)
+    return manager
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss_kb() -> int:
+    """ Current resident memory of this process (kB)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+async def receive(url: str, received: List[Tuple[int, float]]):
+    """ Records sequence numbers and receive times of messages"""
+    async with websockets.connect(url, max_size=None) as connection:
+        async for message in connection:
+            data = json_codec.loads(message)
+            if data.get('type') != 'snapshot':
+                received.append((data['seq'], time.monotonic()))
+
+
+async def run_clients(url: str, clients: int, connected, stop, results):
+    received: List[List[Tuple[int, float]]] = [[] for _ in range(clients)]
+    tasks = [
+        asyncio.ensure_future(receive(url, received[i]))
+        for i in range(clients)
+    ]
+    await asyncio.sleep(0.5 + clients / 200)  # Let all clients connect
+    connected.set()
+    while not stop.is_set():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)  # Messages still on the way
+    for task in tasks:
+        task.cancel()
+    results.send(received)
+
+
+def client_process(url: str, clients: int, connected, stop, results):
+    """ Simulated overlays, they run in a separate process to not take server's CPU time"""
+    asyncio.run(run_clients(url, clients, connected, stop, results))
+
+
+def push_messages(manager: Websocket_manager, duration: float,
+                  player_rate: float, color_rate: float) -> Dict[int, float]:
+    """ Pushes messages at given rates (per second).
+    Returns send time for each sequence number."""
+    sent: Dict[int, float] = {}
+    data = copy.deepcopy(PLAYER_DATA)
+    colors = copy.deepcopy(COLOR_DATA)
+    seq = manager.seq
+    start = time.monotonic()
+    next_player = start if player_rate else float("inf")
+    next_color = start if color_rate else float("inf")
+    while time.monotonic() - start < duration:
+        if time.monotonic() >= next_player:
+            # Corrections change a single field
+            player = random.choice(data['players'])
+            player['rating'] = str(int(player['rating']) + 1)
+            seq += 1
+            sent[seq] = time.monotonic()
+            manager.send({"type": "player_data", "data": data})
+            next_player += 1 / player_rate
+        if time.monotonic() >= next_color:
+            colors[0][3] = round((colors[0][3] + 0.01) % 1, 2)
+            seq += 1
+            sent[seq] = time.monotonic()
+            manager.send({"type": "color", "data": colors})
+            next_color += 1 / color_rate
+        time.sleep(
+            max(0.0, min(next_player, next_color, start + duration) -
+                time.monotonic()))
+    return sent
+
+
+def run(clients: int, args: argparse.Namespace) -> Dict[str, float]:
+    manager = start_manager()
+    manager.send({"type": "player_data", "data": PLAYER_DATA})
+    manager.send({"type": "color", "data": COLOR_DATA})
+    url = f"ws://localhost:{manager.port}/" + ("?delta=1" if args.delta else "")
+
+    context = multiprocessing.get_context("fork")
+    connected, stop = context.Event(), context.Event()
+    results, sender = context.Pipe(duplex=False)
+    process = context.Process(target=client_process,
+                              args=(url, clients, connected, stop, sender))
+    process.start()
+    connected.wait()
+
+    rss_before = rss_kb()
+    cpu_before = cpu_seconds()
+    sent = push_messages(manager, args.duration, args.player_rate,
+                         args.color_rate)
+    stop.set()
+    received = results.recv()
+    process.join()
+    cpu = cpu_seconds() - cpu_before
+    rss_growth = rss_kb() - rss_before
+
+    latencies = sorted(t - sent[seq] for client in received
+                       for seq, t in client if seq in sent)
+    expected = len(sent) * clients
+    return {
+        "delivered": len(latencies) / expected * 100,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "cpu": cpu / args.duration / clients * 1000,
+        "rss": rss_growth,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test of the websocket server")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--player-rate", type=float, default=5,
+                        help="player_data messages per second")
+    parser.add_argument("--color-rate", type=float, default=0.5,
+                        help="color messages per second")
+    parser.add_argument("--delta", action="store_true",
+                        help="clients ask for deltas (as the overlay does)")
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        result = run(clients, args)
+        print(f"{clients:>4} clients | "
+              f"delivered {result['delivered']:5.1f}% | "
+              f"p50 {result['p50']:6.2f} ms | "
+              f"p95 {result['p95']:6.2f} ms | "
+              f"p99 {result['p99']:6.2f} ms | "
+              f"CPU {result['cpu']:5.2f} ms/s per client | "
+              f"RSS {result['rss']:+6d} kB")
+
+
+if __name__ == "__main__":
+    main()
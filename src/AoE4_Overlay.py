@@ -64,7 +64,8 @@ class MainApp(QtWidgets.QMainWindow):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.initUI()
-        self.centralWidget().start()
+        # Started once the event loop runs, so the window is shown first
+        QtCore.QTimer.singleShot(0, self.centralWidget().start)
 
     def initUI(self):
         self.setWindowTitle(f"AoE IV: Overlay ({VERSION})")
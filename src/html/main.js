@@ -1,6 +1,14 @@
 // Websocket connection
 var function_is_running = false;
-var PORT = 7307;
+// Served by the app over HTTP on the websocket port, or opened as a local file
+var PORT = window.location.protocol.startsWith("http") ? window.location.port : 7307;
+// Reconnect delay doubles after each failed attempt (ms)
+var RECONNECT_MIN = 500;
+var RECONNECT_MAX = 30000;
+var reconnect_delay = RECONNECT_MIN;
+// Last received message, so a reconnect sends only what was missed
+var last_seq = null;
+var session = null;
 
 $(document).ready(connect_to_socket);
 
@@ -9,13 +17,20 @@ function connect_to_socket() {
 
     console.log("Trying to connect...");
     function_is_running = true;
-    let socket = new WebSocket(`ws://localhost:${PORT}`);
+    // Ask only for changes of data we already have, and only for data we show
+    let url = `ws://localhost:${PORT}/?delta=1&topics=${TOPICS}`;
+    if (session != null) url += `&since=${last_seq}&session=${session}`;
+    let socket = new WebSocket(url);
     socket.onopen = function (e) {
         console.log("CONNECTED");
+        reconnect_delay = RECONNECT_MIN;
     };
     socket.onmessage = function (event) {
         let data = JSON.parse(event.data);
         console.log(`New event: ${event.data}`);
+        if (data.type == "snapshot") session = data.session;
+        else if (last_seq != null && data.seq <= last_seq) return; // Already have it
+        last_seq = data.seq;
         parse_message(data);
     };
 
@@ -26,56 +41,115 @@ function connect_to_socket() {
     };
 
     socket.onerror = function (error) {
+        // `onclose` follows and reconnects
         console.log('ERROR: ' + error);
-        reconnect_to_socket()
     };
 }
 
 function reconnect_to_socket() {
-    console.log('Reconnecting..')
+    console.log(`Reconnecting in ${reconnect_delay} ms..`)
     function_is_running = false;
     setTimeout(function () {
         connect_to_socket();
-    }, 500);
+    }, reconnect_delay);
+    reconnect_delay = Math.min(reconnect_delay * 2, RECONNECT_MAX);
 }
 
 // Overlay functionality
 var team_colors = [[74, 255, 2, 0.35], [3, 179, 255, 0.35], [255, 0, 0, 0.35]];
 var custom_func = null;
+// Show games of a watched profile instead of the main player (overlay.html?profile=<profile ID>)
+var PROFILE = new URLSearchParams(window.location.search).get("profile");
+var TOPICS = PROFILE == null ? "color,player_data" : `color,profile_data/${PROFILE}`;
+
+// Latest data of each kind of message, so deltas can be applied
+var states = {};
 
 function parse_message(data) {
+    if (data.type == "snapshot") {
+        // Latest message of each type
+        for (const message of data.data) parse_message(message);
+        return;
+    }
+    let key = data.profile_id == null ? data.type : `${data.type}/${data.profile_id}`;
+    if ("delta" in data) data.data = apply_patch(states[key], data.delta);
+    states[key] = data.data;
+
     if (data.type == "color")
         team_colors = data.data;
-    else if (data.type == "player_data")
+    else if (data.type == "player_data" && PROFILE == null)
         update_player_data(data.data)
+    else if (data.type == "profile_data" && String(data.profile_id) == PROFILE)
+        update_player_data(data.data)
+}
+
+// Returns `old` with the patch applied, see `overlay/delta.py` for the format
+function apply_patch(old, patch) {
+    if ("$set" in patch) return patch["$set"];
+    if ("$dict" in patch) {
+        let result = Object.assign({}, old);
+        for (const key of patch["$del"] || []) delete result[key];
+        for (const [key, value] of Object.entries(patch["$dict"]))
+            result[key] = apply_patch(result[key], value);
+        return result;
+    }
+    let result = old.slice(0, patch["$list"]);
+    for (const [index, value] of Object.entries(patch.items))
+        result[Number(index)] = apply_patch(result[Number(index)], value);
+    return result;
+}
+
+// Sets text of an element only if it changed
+function set_text(element, text) {
+    if (element.text() != text) element.text(text);
+}
+
+function player_rows(flag_first) {
+    let flag = '<td class="flag" rowspan="2"><img></td>';
+    let name = '<td colspan="5" class="name"></td>';
+    return `<tr class="player">${flag_first ? flag + name : name + flag}</tr>
+        <tr class="stats"><td class="rank"></td><td class="rating"></td>
+        <td class="winrate"></td><td class="wins"></td><td class="losses"></td></tr>`;
+}
+
+// Updates a team table, reusing existing rows and changing only cells that changed
+function update_team(table, players, flag_first) {
+    let rows = table.find("tr.player");
+    if (rows.length != players.length || table.data("flag_first") !== flag_first) {
+        table.html(players.map(() => player_rows(flag_first)).join(""));
+        table.data("flag_first", flag_first);
+        rows = table.find("tr.player");
+    }
+    players.forEach(function (p, i) {
+        let row = rows.eq(i);
+        let stats = row.next("tr.stats");
+        // Changing `src` reloads the image, so only do it when the civ changes
+        let img = row.find(".flag img");
+        let src = `../img/flags/${p.civ}.webp`;
+        if (img.attr("src") != src) img.attr("src", src);
+        set_text(row.find(".name"), p.name);
+        set_text(stats.find(".rank"), p.rank);
+        set_text(stats.find(".rating"), p.rating);
+        set_text(stats.find(".winrate"), p.winrate);
+        // Whether to add W/L or not
+        set_text(stats.find(".wins"), p.wins == '' ? '' : `${p.wins}W`);
+        set_text(stats.find(".losses"), p.losses == '' ? '' : `${p.losses}L`);
+    });
 }
 
 function update_player_data(data) {
-    $("#map").text(data.map);
-    let team_data = { 1: "", 2: "" };
+    set_text($("#map"), data.map);
+    let team_data = { 1: [], 2: [] };
     let first_team = null;
     let second_team = null;
     for (const p of data.players) {
         if (first_team == null) first_team = p.team;
-        // Decide where to place flag 
-        let flag = `<td class="flag" rowspan="2"><img src="../img/flags/${p.civ}.webp"></td>`;
-        let t1f = '';
-        let t2f = '';
-        if (p.team == first_team) t1f = flag; else t2f = flag;
-        let wins, losses;
-        // Whether to add W/L or not
-        if (p.wins == '') wins = ''; else wins = `${p.wins}W`;
-        if (p.losses == '') losses = ''; else losses = `${p.losses}L`;
-        // Create player element
-        let s = `<tr class="player">${t1f}<td colspan="5" class="name">${p.name}</td>${t2f}</tr>
-        <tr class="stats"><td class="rank">${p.rank}</td><td class="rating">${p.rating}</td>
-        <td class="winrate">${p.winrate}</td><td class="wins">${wins}</td><td class="losses">${losses}</td></tr>`;
         if ([1, 2].includes(p.team))
-            team_data[p.team] += s;
+            team_data[p.team].push(p);
     }
     if (first_team == 1) second_team = 2; else second_team = 1;
-    $("#team1").html(team_data[first_team]);
-    $("#team2").html(team_data[second_team]);
+    // Flags are on the outer side of the first and the second team
+    update_team($("#team1"), team_data[first_team] || [], true);
+    update_team($("#team2"), team_data[second_team] || [], false);
     if (custom_func != null) custom_func(data)
 }
-
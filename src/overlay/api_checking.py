@@ -1,59 +1,144 @@
-import json
+import asyncio
+import hashlib
+import threading
 import time
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import (Any, Awaitable, Callable, Dict, Iterator, List, Optional,
+                    Tuple)
 
 import requests
 
+import overlay.http_client as http_client
+import overlay.json_codec as json_codec
+from overlay.governor import RateLimited, ServiceUnavailable
 from overlay.logging_func import get_logger
+from overlay.match_store import match_store
+from overlay.poll_scheduler import PollScheduler
 from overlay.settings import settings
 
 logger = get_logger(__name__)
-session = requests.session()
 
+# Runs profile_id and query lookups concurrently
+LOOKUP_EXECUTOR = ThreadPoolExecutor(max_workers=4,
+                                     thread_name_prefix="player_lookup")
+# Recently found players {lowercase text: (time found, player)}
+FIND_PLAYER_CACHE: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+FIND_PLAYER_CACHE_SIZE = 50
+FIND_PLAYER_CACHE_TTL = 60 * 60  # Seconds
 
-def find_player(text: str) -> bool:
-    """ Tries to find a player based on a text containing either name, steam_id or profile_id
-    Returns `True` if the player was found. Settings are automatically updated."""
 
-    # Save the current player settings
-    old = (settings.player_name, settings.profile_id, settings.steam_id)
+def _get_json_unless_cancelled(url: str, endpoint: str,
+                               cancelled: threading.Event) -> Any:
+    """ Gets JSON data from the url. Returns `None` if the request was cancelled in the meantime.
+    The body of a cancelled request isn't downloaded."""
+    with http_client.get(url, endpoint, stream=True) as resp:
+        if cancelled.is_set():
+            return None
+        return json_codec.loads(resp.content)
+
 
-    # First try if it's a profile id
+def _find_by_profile_id(text: str,
+                        cancelled: threading.Event) -> Optional[Dict[str, Any]]:
+    """ Tries to find a player by profile_id (or steam_id)"""
     try:
         url = f"https://aoe4world.com/api/v0/players/{text}"
-        resp = json.loads(session.get(url).text)
-        if 'name' in resp:
-            settings.profile_id = resp['profile_id']
-            settings.player_name = resp['name']
-            settings.steam_id = resp.get('steam_id')
-            logger.info(
-                f"Found player by profile_id: {settings.player_name} ({settings.profile_id})"
-            )
-            return True
-    except json.decoder.JSONDecodeError:
+        resp = _get_json_unless_cancelled(url, "player", cancelled)
+        if resp is not None and 'name' in resp:
+            return resp
+    except json_codec.JSONDecodeError:
         ...
     except Exception:
         logger.exception("")
+    return None
 
-    # Then try query
+
+def _find_by_query(text: str,
+                   cancelled: threading.Event) -> Optional[Dict[str, Any]]:
+    """ Tries to find a player by searching for the text"""
     try:
         url = f"https://aoe4world.com/api/v0/players/search?query={text}"
-        resp = json.loads(session.get(url).text)
-        if resp['players']:
-            settings.profile_id = resp['players'][0]['profile_id']
-            settings.player_name = resp['players'][0]['name']
-            settings.steam_id = resp['players'][0].get('steam_id')
-            logger.info(
-                f"Found player by query: {settings.player_name} ({settings.profile_id})"
-            )
-            return True
+        resp = _get_json_unless_cancelled(url, "player_search", cancelled)
+        if resp is not None and resp['players']:
+            return resp['players'][0]
     except Exception:
         logger.exception("")
+    return None
 
-    logger.info(f"Failed to find a player with: {text}")
-    settings.player_name, settings.profile_id, settings.steam_id = old
-    return False
+
+def find_player(text: str,
+                cancel_token: Optional[threading.Event] = None) -> bool:
+    """ Tries to find a player based on a text containing either name, steam_id or profile_id
+    Returns `True` if the player was found. Settings are automatically updated,
+    unless `cancel_token` was set in the meantime (a newer search replaced this one).
+
+    Both profile_id and query lookups run at the same time. A profile_id hit has priority,
+    otherwise the first valid answer is used. Recent results are cached."""
+    start = time.perf_counter()
+    key = text.lower()
+
+    cached = FIND_PLAYER_CACHE.get(key)
+    if cached is not None and time.time() - cached[0] < FIND_PLAYER_CACHE_TTL:
+        FIND_PLAYER_CACHE.move_to_end(key)
+        _use_player(cached[1])
+        logger.info(
+            f"Found player in cache: {settings.player_name} ({settings.profile_id}) "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return True
+
+    cancelled = threading.Event()
+    profile_future = LOOKUP_EXECUTOR.submit(_find_by_profile_id, text,
+                                            cancelled)
+    query_future = LOOKUP_EXECUTOR.submit(_find_by_query, text, cancelled)
+
+    player, method = None, ""
+    for future in as_completed((profile_future, query_future)):
+        result = future.result()
+        if result is None:
+            continue
+        player = result
+        if future is profile_future:
+            method = "profile_id"
+            break
+        method = "query"
+        # Profile ids and steam ids start with a digit. Wait for that lookup then.
+        if not text[:1].isdigit():
+            break
+
+    # Cancel the slower request
+    cancelled.set()
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if player is None:
+        logger.info(f"Failed to find a player with: {text} ({elapsed:.0f} ms)")
+        return False
+
+    player = {
+        'profile_id': player['profile_id'],
+        'name': player['name'],
+        'steam_id': player.get('steam_id')
+    }
+    FIND_PLAYER_CACHE[key] = (time.time(), player)
+    FIND_PLAYER_CACHE.move_to_end(key)
+    while len(FIND_PLAYER_CACHE) > FIND_PLAYER_CACHE_SIZE:
+        FIND_PLAYER_CACHE.popitem(last=False)
+
+    if cancel_token is not None and cancel_token.is_set():
+        logger.info(f"Search for {text} was replaced by a newer one")
+        return False
+    _use_player(player)
+    logger.info(
+        f"Found player by {method}: {settings.player_name} ({settings.profile_id}) in {elapsed:.0f} ms"
+    )
+    return True
+
+
+def _use_player(player: Dict[str, Any]):
+    """ Updates settings with the found player"""
+    settings.profile_id = player['profile_id']
+    settings.player_name = player['name']
+    settings.steam_id = player['steam_id']
 
 
 # Not used anymore
@@ -66,9 +151,9 @@ def get_rating_history(leaderboard_id: int, amount: int = 1) -> List[Any]:
     else:
         return []
 
-    resp = session.get(url).text
+    resp = http_client.get(url, "rating_history").content
     try:
-        return json.loads(resp)
+        return json_codec.loads(resp)
     except:
         logger.warning(f"Failed to parse rating history: {resp}")
         return []
@@ -86,88 +171,312 @@ def get_leaderboard_data(leaderboard_id: int) -> Dict[str, Any]:
     else:
         return {}
 
-    resp = session.get(url).text
+    resp = http_client.get(url, "leaderboard").content
     try:
-        return json.loads(resp)
+        return json_codec.loads(resp)
     except:
         logger.warning(f"Failed to parse leaderboard data: {resp}")
         return {}
 
 
-def get_full_match_history(amount: int) -> Optional[List[Any]]:
-    """ Gets match history and adds some data its missing"""
-
-    url = f"https://aoe4world.com/api/v0/players/{settings.profile_id}/games?limit={amount}"
+def iter_match_history(profile_id: int,
+                       since: Optional[str] = None,
+                       per_page: int = 100) -> Iterator[List[Any]]:
+    """ Walks through pages of match history (newest first) and yields games from each page.
+    Only games started since `since` are included if provided."""
+    page = 1
+    while True:
+        url = f"https://aoe4world.com/api/v0/players/{profile_id}/games?page={page}&limit={per_page}"
+        if since is not None:
+            url += f"&since={since}"
+        data = json_codec.loads(http_client.get(url, "match_history").content)
+        games = data['games']
+        if not games:
+            return
+        yield games
+        # The server can use a smaller page size than we asked for
+        page_size = data.get('per_page', len(games))
+        if len(games) < page_size or page * page_size >= data.get(
+                'total_count', float('inf')):
+            return
+        page += 1
+
+
+def sync_match_history(
+        profile_id: int,
+        progress_callback: Callable,
+        cancel_token: Optional[threading.Event] = None
+) -> Optional[List[Any]]:
+    """ Downloads games since the last complete sync and saves them.
+    Each page of new games is passed to `progress_callback` as it arrives.
+    Returns all new games or `None` if the download failed.
+    Stops before storing the next page when `cancel_token` is set.
+
+    Pages come newest first, so the sync point moves only once all pages were stored.
+    An interrupted sync is downloaded again from the previous sync point."""
+    since = match_store.synced_through(profile_id)
+    new_games = []
     try:
-        resp = session.get(url).text
-        data = json.loads(resp)
-        return data['games']
+        for games in iter_match_history(profile_id, since):
+            # A cancelled sync leaves the store and its sync point as they were
+            if cancel_token is not None and cancel_token.is_set():
+                logger.info(f"Match history sync of {profile_id} cancelled")
+                return new_games
+            match_store.add_games(profile_id, games)
+            progress_callback.emit(games)
+            new_games.extend(games)
     except Exception:
         logger.exception("")
-        return None
+        if not new_games:
+            return None
+        return new_games
+    finished = [g['started_at'] for g in new_games if not g.get('ongoing')]
+    if finished:
+        match_store.set_synced_through(profile_id, max(finished))
+    logger.info(
+        f"Synced match history: {len(new_games)} new games (since {since})")
+    return new_games
 
 
 class Api_checker:
+    """ Checks for new games of the main profile and watched profiles (`settings.watched_profiles`)"""
 
     def __init__(self):
-        self.force_stop = False  # To stop the thread
-        self.force_check = False  # This can force a check of new data
-        self.last_match_timestamp = datetime(1900, 1, 1, 0, 0, 0)
+        self._stop = threading.Event()  # To stop polling
+        self._check = threading.Event()  # This can force a check of new data
+        # Event loop of `poll` and its event for waking it up from `sleep`
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        # Start of the last shown game for each profile (seconds)
+        self.last_match_timestamps: Dict[int, float] = {}
         self.last_rating_timestamp = datetime(1900, 1, 1, 0, 0, 0)
+        # Validators (ETag/Last-Modified), body hashes and parsed data for each url
+        self.validators: Dict[str, Dict[str, str]] = {}
+        self.body_hashes: Dict[str, bytes] = {}
+        self.last_games: Dict[str, Dict[str, Any]] = {}
+        # Counters of responses that were skipped or fully parsed
+        self.skipped_parses = 0
+        self.full_parses = 0
+        self.schedulers: Dict[int, PollScheduler] = {}
 
     def reset(self):
         """ Resets last timestamps"""
-        self.last_match_timestamp = datetime(1900, 1, 1, 0, 0, 0)
+        self.last_match_timestamps.clear()
         self.last_rating_timestamp = datetime(1900, 1, 1, 0, 0, 0)
+        self.validators.clear()
+        self.body_hashes.clear()
+        self.last_games.clear()
+        self.schedulers.clear()
         self.force_check = True
 
-    def sleep(self, seconds: int) -> bool:
-        """ Sleeps while checking for force_stop
-        Returns `True` if we need to stop the parent function"""
-        for _ in range(seconds * 2):
-            if self.force_stop:
-                return True
+    @staticmethod
+    def profile_ids() -> List[int]:
+        """ Returns the main profile followed by watched profiles"""
+        profile_ids = [settings.profile_id] if settings.profile_id else []
+        for profile_id in settings.watched_profiles:
+            if profile_id not in profile_ids:
+                profile_ids.append(profile_id)
+        return profile_ids
+
+    def scheduler_for(self, profile_id: int) -> PollScheduler:
+        if profile_id not in self.schedulers:
+            self.schedulers[profile_id] = PollScheduler(profile_id)
+        return self.schedulers[profile_id]
+
+    @property
+    def scheduler(self) -> PollScheduler:
+        """ Scheduler of the main profile"""
+        return self.scheduler_for(settings.profile_id)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """ Returns headers for a conditional request based on saved validators"""
+        validators = self.validators.get(url, {})
+        headers = {}
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def is_unchanged(self, url: str, resp: requests.Response) -> bool:
+        """ Checks whether the response is the same as the last one for this url.
+        Saves new validators and body hash if it isn't."""
+        if resp.status_code == 304:
+            return True
 
-            if self.force_check:
-                self.force_check = False
-                return False
+        digest = hashlib.sha1(resp.content).digest()
+        if self.body_hashes.get(url) == digest:
+            return True
 
-            time.sleep(0.5)
+        self.body_hashes[url] = digest
+        self.validators[url] = {}
+        if 'ETag' in resp.headers:
+            self.validators[url]['etag'] = resp.headers['ETag']
+        if 'Last-Modified' in resp.headers:
+            self.validators[url]['last_modified'] = resp.headers[
+                'Last-Modified']
         return False
 
-    def check_for_new_game(self,
-                           delayed_seconds: int = 0
-                           ) -> Optional[Dict[str, Any]]:
-        """ Continously check if there are a new game being played
-        Returns match data if there is a new game"""
-
-        if self.sleep(delayed_seconds):
-            return
-
-        while True:
-            result = self.get_data()
-            if result is not None:
-                return result
+    def parse_stats(self) -> str:
+        """ Returns a summary of skipped and fully parsed responses"""
+        return f"{self.full_parses} parsed, {self.skipped_parses} skipped"
+
+    @property
+    def force_stop(self) -> bool:
+        return self._stop.is_set()
+
+    @force_stop.setter
+    def force_stop(self, value: bool):
+        if value:
+            self._stop.set()
+            self._wake_up()
+        else:
+            self._stop.clear()
+
+    @property
+    def force_check(self) -> bool:
+        return self._check.is_set()
+
+    @force_check.setter
+    def force_check(self, value: bool):
+        if value:
+            self._check.set()
+            self._wake_up()
+        else:
+            self._check.clear()
+
+    def _wake_up(self):
+        """ Wakes up `sleep` (thread-safe)"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def sleep(self, seconds: float) -> bool:
+        """ Sleeps until the time runs out, a check is forced or polling is stopped.
+        Returns `True` if we need to stop polling"""
+        if not self._check.is_set() and not self.force_stop:
+            try:
+                await asyncio.wait_for(self._wake.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        self._wake.clear()
+        if self.force_stop:
+            return True
+        self._check.clear()
+        return False
 
-            if self.sleep(settings.interval):
+    async def poll(self, run_blocking: Callable[..., Awaitable],
+                   report: Callable[[str, Any], None]):
+        """ Continously checks if there are new games being played (runs in an event loop).
+
+        `run_blocking` runs a blocking function off the event loop, `report` passes
+        results on: `("new_game", data)` for the main profile and
+        `("watched_game", (profile_id, data))` for watched profiles."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        delay = 0
+        while not await self.sleep(delay):
+            # Wait for rate limit tokens here, not in an executor thread
+            if await self.sleep(
+                    http_client.governor(http_client.AOE4WORLD_HOST).wait_time(
+                        len(self.profile_ids()))):
+                break
+            # An unexpected error in one check mustn't stop polling for the session
+            try:
+                result = await run_blocking(
+                    self.get_data, lambda game: report("watched_game", game))
+                if result is not None:
+                    report("new_game", result)
+            except Exception:
+                logger.exception("Checking for new games failed")
+            delay = self.next_interval()
+
+    def next_interval(self) -> float:
+        """ Returns seconds to wait before the next check (longer while the API is unavailable)"""
+        intervals = [
+            self.scheduler_for(i).next_interval() for i in self.profile_ids()
+        ]
+        return max(min(intervals, default=settings.interval),
+                   http_client.governor(http_client.AOE4WORLD_HOST).retry_in())
+
+    def get_data(
+        self,
+        watched_callback: Optional[Callable] = None
+    ) -> Optional[Dict[str, Any]]:
+        """ Checks last games of all profiles. Returns a new game of the main profile.
+        New games of watched profiles are passed to `watched_callback` as `(profile_id, data)`"""
+        result = None
+        # Ongoing games of profiles found in games of other profiles
+        known_games: Dict[int, Dict[str, Any]] = {}
+
+        for profile_id in self.profile_ids():
+            if self.force_stop:
                 return
 
-    def get_data(self) -> Optional[Dict[str, Any]]:
-        if self.force_stop:
-            return
-
-        # Get last match from aoe4world.com
+            if profile_id in known_games:
+                data = known_games[profile_id]
+            else:
+                try:
+                    data = self.get_last_game(profile_id)
+                except RateLimited as e:
+                    # Only our own limit, the rest is checked next round
+                    logger.warning(str(e))
+                    break
+                except ServiceUnavailable as e:
+                    logger.warning(str(e))
+                    # The main game isn't lost, next rounds report the outage
+                    if result is not None:
+                        break
+                    return {'server_down': True}
+                if data is None:
+                    continue
+                # A player can be only in one ongoing game, no need to fetch it for the others
+                if data.get('ongoing'):
+                    for team in data['teams']:
+                        for player in team:
+                            known_games.setdefault(player['profile_id'], data)
+
+            self.scheduler_for(profile_id).observe_game(data)
+            if data['started_sec'] <= self.last_match_timestamps.get(
+                    profile_id, 0):
+                continue
+            if profile_id == settings.profile_id:
+                # Marked as shown only once it's returned, a later profile can fail the round
+                result = data
+                continue
+            self.last_match_timestamps[profile_id] = data['started_sec']
+            if watched_callback is not None:
+                watched_callback((profile_id, data))
+
+        if result is not None:
+            self.last_match_timestamps[settings.profile_id] = result[
+                'started_sec']
+        return result
+
+    def get_last_game(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        """ Gets the last game of the profile from aoe4world.com
+        Parsed data are reused when the response hasn't changed."""
         try:
-            url = f"https://aoe4world.com/api/v0/players/{settings.profile_id}/games/last"
-            resp = session.get(url)
-            data = json.loads(resp.text)
+            url = f"https://aoe4world.com/api/v0/players/{profile_id}/games/last"
+            resp = http_client.get(url,
+                                   "last_game",
+                                   headers=self.conditional_headers(url))
+            # Error responses (already counted by the governor) aren't parsed or cached
+            if resp.status_code != 304 and not resp.ok:
+                logger.warning(
+                    f"Last game of {profile_id}: HTTP {resp.status_code}")
+                return
+            if self.is_unchanged(url, resp):
+                self.skipped_parses += 1
+                return self.last_games.get(url)
+            data = json_codec.loads(resp.content)
+            self.full_parses += 1
+        except (ServiceUnavailable, RateLimited):
+            raise
         except Exception:
             logger.exception("")
             return
 
-        if self.force_stop:
-            return
-        if "error" in data:
+        if "error" in data or "started_at" not in data:
             return
 
         # Calc old leaderboard id
@@ -178,11 +487,12 @@ class Api_checker:
             logger.exception("")
 
         # Calc started time
-        started = datetime.strptime(data['started_at'],
-                                    "%Y-%m-%dT%H:%M:%S.000Z")
-        data['started_sec'] = started.timestamp()
-
-        # Show the last game
-        if started > self.last_match_timestamp:  # and data['ongoing']:
-            self.last_match_timestamp = started
-            return data
+        try:
+            started = datetime.strptime(data['started_at'],
+                                        "%Y-%m-%dT%H:%M:%S.000Z")
+        except (TypeError, ValueError):
+            logger.warning(f"Unexpected started_at: {data['started_at']}")
+            return
+        data['started_sec'] = started.replace(tzinfo=timezone.utc).timestamp()
+        self.last_games[url] = data
+        return data
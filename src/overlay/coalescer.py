@@ -0,0 +1,41 @@
+from typing import Any, Callable
+
+from PyQt5 import QtCore
+
+FRAME_INTERVAL_MS = 33  # ~30 updates per second
+
+
+class Coalescer(QtCore.QObject):
+    """ Merges bursts of updates into at most one per `interval` (milliseconds).
+
+    The first update is delivered at once, updates arriving during the interval replace
+    each other and only the last one is delivered when the interval ends.
+    Has to be used from the Qt main thread."""
+    def __init__(self,
+                 callback: Callable[[Any], None],
+                 interval: int = FRAME_INTERVAL_MS):
+        super().__init__()
+        self.callback = callback
+        self.pending = None
+        self.has_pending = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self._flush)
+
+    def push(self, value: Any):
+        if self.timer.isActive():
+            self.pending = value
+            self.has_pending = True
+            return
+        self.callback(value)
+        self.timer.start()
+
+    def _flush(self):
+        """ The interval ended, delivers the last update if there was any"""
+        if not self.has_pending:
+            self.timer.stop()
+            return
+        value = self.pending
+        self.pending = None
+        self.has_pending = False
+        self.callback(value)
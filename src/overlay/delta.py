@@ -0,0 +1,46 @@
+""" Structural diffs of JSON-like data, so clients get only what changed.
+
+A patch is one of:
+    {"$set": value}                               replaces the value
+    {"$dict": {key: patch, ...}, "$del": [key, ...]}  patches a dict
+    {"$list": length, "items": {"index": patch, ...}} patches a list (truncated or extended to `length`)
+"""
+from typing import Any, Dict, Optional
+
+
+def diff(old: Any, new: Any) -> Optional[Dict[str, Any]]:
+    """ Returns a patch turning `old` into `new`, `None` if they are equal"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        changed = {}
+        for key, value in new.items():
+            if key not in old:
+                changed[key] = {"$set": value}
+                continue
+            patch = diff(old[key], value)
+            if patch is not None:
+                changed[key] = patch
+        removed = [key for key in old if key not in new]
+        if not changed and not removed:
+            return None
+        patch = {"$dict": changed}
+        if removed:
+            patch["$del"] = removed
+        return patch
+
+    if isinstance(old, list) and isinstance(new, list):
+        items = {}
+        for index, value in enumerate(new):
+            if index >= len(old):
+                items[str(index)] = {"$set": value}
+                continue
+            patch = diff(old[index], value)
+            if patch is not None:
+                items[str(index)] = patch
+        if not items and len(old) == len(new):
+            return None
+        return {"$list": len(new), "items": items}
+
+    if type(old) == type(new) and old == new:
+        return None
+    return {"$set": new}
+
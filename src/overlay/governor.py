@@ -0,0 +1,218 @@
+import email.utils
+import threading
+import time
+from typing import Callable, List, Mapping, Optional
+
+from overlay.logging_func import get_logger
+
+logger = get_logger(__name__)
+
+
+class ServiceUnavailable(Exception):
+    """ Raised when a request isn't made because the service is unhealthy"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"{host} unavailable, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class RateLimited(Exception):
+    """ Raised when our own rate limit didn't allow the request in time.
+    The service itself may be fine."""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(
+            f"Rate limit for {host} reached, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Returns seconds to wait based on `Retry-After` header (seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        ...
+    try:
+        return max(
+            email.utils.parsedate_to_datetime(value).timestamp() - time.time(),
+            0)
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """ Allows `rate` requests per second on average with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """ Returns seconds until `tokens` are available (without taking them)"""
+        with self.lock:
+            self._refill(time.monotonic())
+            missing = min(tokens, self.capacity) - self.tokens
+            return max(missing / self.rate, 0)
+
+    def acquire(self, timeout: float) -> bool:
+        """ Takes a token, waiting up to `timeout` seconds for one.
+        Returns `False` if there wasn't any in time."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """ Stops requests after repeated failures.
+
+    closed: requests are allowed
+    open: requests are refused until the backoff runs out (doubles with each opening)
+    half-open: one probing request is allowed, its result closes or reopens the breaker"""
+
+    def __init__(self,
+                 failure_threshold: int = 3,
+                 base_backoff: float = 10,
+                 max_backoff: float = 300):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = "closed"
+        self.failures = 0
+        self.openings = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def retry_in(self) -> float:
+        """ Returns seconds until requests are allowed again"""
+        if self.state != "open":
+            return 0
+        return max(self.open_until - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        if self.state == "open" and self.retry_in() == 0:
+            self.state = "half-open"
+            self.probing = False
+        if self.state == "half-open":
+            if self.probing:
+                return False
+            self.probing = True
+        return self.state != "open"
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.openings = 0
+        self.probing = False
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """ Counts a failure. A `retry_after` value opens the breaker immediately."""
+        self.failures += 1
+        self.probing = False
+        if (retry_after is None and self.state == "closed"
+                and self.failures < self.failure_threshold):
+            return
+
+        backoff = min(self.base_backoff * 2**self.openings, self.max_backoff)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        self.openings += 1
+        self.state = "open"
+        self.open_until = time.monotonic() + backoff
+
+
+class Governor:
+    """ Governs requests to a single host with a token bucket and a circuit breaker.
+    Respects `Retry-After` on 429 and 503 responses."""
+
+    def __init__(self, host: str, rate: float = 1, burst: float = 5):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        self.lock = threading.Lock()
+        self.listeners: List[Callable[[str], None]] = []
+        self.state = self.breaker.state
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """ Adds a function called with a status text whenever the breaker state changes"""
+        self.listeners.append(callback)
+        callback(self.describe())
+
+    def describe(self) -> str:
+        """ Returns a text describing the current state"""
+        if self.breaker.state == "open":
+            return f"unavailable (retry in {self.breaker.retry_in():.0f}s)"
+        if self.breaker.state == "half-open":
+            return "recovering"
+        return "ok"
+
+    def retry_in(self) -> float:
+        """ Returns seconds until requests are allowed again"""
+        with self.lock:
+            return self.breaker.retry_in()
+
+    def wait_time(self, requests: int = 1) -> float:
+        """ Returns seconds until `requests` can be made without waiting for tokens.
+        Lets callers wait without holding a thread (`before_request` then returns at once)."""
+        return max(self.bucket.wait_time(requests), self.retry_in())
+
+    def before_request(self):
+        """ Waits for a token. Raises `ServiceUnavailable` if the request shouldn't be made
+        and `RateLimited` if there wasn't a token in time."""
+        with self.lock:
+            allowed = self.breaker.allow()
+            self._state_changed()
+            if not allowed:
+                raise ServiceUnavailable(self.host, self.breaker.retry_in())
+        if not self.bucket.acquire(timeout=10):
+            with self.lock:
+                self.breaker.probing = False
+            raise RateLimited(self.host, 1 / self.bucket.rate)
+
+    def after_response(self, status_code: int, headers: Mapping[str, str]):
+        with self.lock:
+            if status_code == 429 or status_code >= 500:
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                self.breaker.record_failure(retry_after)
+                logger.warning(
+                    f"{self.host} responded with {status_code} (Retry-After: {retry_after})"
+                )
+            else:
+                self.breaker.record_success()
+            self._state_changed()
+
+    def after_error(self):
+        """ Counts connection errors and timeouts as failures"""
+        with self.lock:
+            self.breaker.record_failure()
+            self._state_changed()
+
+    def _state_changed(self):
+        if self.breaker.state == self.state:
+            return
+        self.state = self.breaker.state
+        status = self.describe()
+        logger.info(f"{self.host} API status: {status}")
+        for callback in self.listeners:
+            try:
+                callback(status)
+            except Exception:
+                logger.exception("")
@@ -1,4 +1,3 @@
-import json
 import os
 import pathlib
 import sys
@@ -6,9 +5,10 @@ import time
 import traceback
 from typing import Any, Dict, Optional, Union
 
-import requests
 from PyQt5 import QtCore
 
+import overlay.http_client as http_client
+import overlay.json_codec as json_codec
 from overlay.aoe4_data import QM_ids
 from overlay.logging_func import get_logger
 from overlay.settings import settings
@@ -50,7 +50,7 @@ def version_check(version: str) -> str:
     """ Checks version. Returns either link for the new version or an empty string. """
     try:
         url = "https://raw.githubusercontent.com/FluffyMaguro/AoE4_Overlay/main/version.json"
-        data = json.loads(requests.get(url).text)
+        data = json_codec.loads(http_client.get(url, "version").content)
         if version_to_int(version) < version_to_int(data['version']):
             return data['link']
     except Exception:
@@ -81,11 +81,14 @@ def match_mode(match: Dict[str, Any], convert_customs: bool = True) -> int:
     return int(leaderboard_id)
 
 
-def process_game(game_data: Dict[str, Any]) -> Dict[str, Any]:
+def process_game(game_data: Dict[str, Any],
+                 main_profile_id: Optional[int] = None) -> Dict[str, Any]:
     """ Processes game data returned by API
     
-    Sorts players to main is at the top. Calculates winrates. 
-    Gets text for civs and maps. Apart from `team`, all player data returned as string."""
+    Sorts players to main is at the top (`settings.profile_id` unless `main_profile_id` is given).
+    Calculates winrates. Gets text for civs and maps. Apart from `team`, all player data returned as string."""
+    if main_profile_id is None:
+        main_profile_id = settings.profile_id
     result = {}
     result['map'] = game_data['map']
     result['mode'] = game_data['leaderboard_id']
@@ -107,7 +110,7 @@ def process_game(game_data: Dict[str, Any]) -> Dict[str, Any]:
         for player in team:
             player['team'] = idx
             players.append(player)
-            if player['profile_id'] == settings.profile_id:
+            if player['profile_id'] == main_profile_id:
                 main_team = idx
 
     def sortingf(player: Dict[str, Any]) -> int:
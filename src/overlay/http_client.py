@@ -0,0 +1,126 @@
+import statistics
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+from typing import Deque, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from overlay.governor import Governor
+from overlay.logging_func import get_logger
+
+logger = get_logger(__name__)
+
+# (connect, read) timeouts in seconds for each endpoint
+TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "last_game": (3.05, 10),
+    "match_history": (3.05, 30),
+    "player": (3.05, 10),
+    "player_search": (3.05, 10),
+    "version": (3.05, 10),
+    "warm_up": (3.05, 5),
+}
+DEFAULT_TIMEOUT = (3.05, 20)
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+AOE4WORLD_HOST = "aoe4world.com"
+
+# Request rate (per second) and burst size for each host
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {AOE4WORLD_HOST: (2, 10)}
+DEFAULT_RATE_LIMIT = (1, 5)
+_governors: Dict[str, Governor] = {}
+_governors_lock = threading.Lock()
+
+
+def governor(host: str) -> Governor:
+    """ Returns the governor for given host"""
+    with _governors_lock:
+        if host not in _governors:
+            rate, burst = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            _governors[host] = Governor(host, rate, burst)
+        return _governors[host]
+
+
+class LatencyMetrics:
+    """ Keeps recent latencies and error counts for each endpoint"""
+
+    def __init__(self, size: int = 200):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=size))
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.requests[endpoint] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Returns request count, errors and latency percentiles (ms) for each endpoint"""
+        result = {}
+        with self.lock:
+            for endpoint, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                result[endpoint] = {
+                    "requests": self.requests[endpoint],
+                    "errors": self.errors[endpoint],
+                    "p50": statistics.median(ordered) * 1000,
+                    "p95": ordered[int(0.95 * (len(ordered) - 1))] * 1000,
+                    "max": ordered[-1] * 1000,
+                }
+        return result
+
+    def log_summary(self):
+        for endpoint, data in self.summary().items():
+            logger.info(
+                f"{endpoint}: {data['requests']} requests ({data['errors']} errors) | "
+                f"p50 {data['p50']:.0f} ms | p95 {data['p95']:.0f} ms | max {data['max']:.0f} ms"
+            )
+
+
+metrics = LatencyMetrics()
+
+
+def request(method: str, url: str, endpoint: str,
+            **kwargs) -> requests.Response:
+    """ Makes a request through the shared session with timeouts for given endpoint.
+    Records the latency (time until headers are received).
+
+    Requests go through the governor of the host and raise `ServiceUnavailable`
+    when the service is unhealthy or `RateLimited` when our rate limit was hit."""
+    kwargs.setdefault('timeout', TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+    host_governor = governor(urllib.parse.urlsplit(url).hostname or "")
+    host_governor.before_request()
+    start = time.perf_counter()
+    try:
+        resp = session.request(method, url, **kwargs)
+    except Exception:
+        metrics.record(endpoint, time.perf_counter() - start, False)
+        host_governor.after_error()
+        raise
+    metrics.record(endpoint,
+                   time.perf_counter() - start, resp.status_code < 400)
+    host_governor.after_response(resp.status_code, resp.headers)
+    return resp
+
+
+def get(url: str, endpoint: str, **kwargs) -> requests.Response:
+    """ GET request, see `request`"""
+    return request("GET", url, endpoint, **kwargs)
+
+
+def warm_up():
+    """ Opens a connection to aoe4world in advance, so the next request skips TCP and TLS handshakes"""
+    try:
+        request("HEAD", "https://aoe4world.com/api/v0/", "warm_up")
+    except Exception:
+        logger.warning("Failed to open a connection to aoe4world")
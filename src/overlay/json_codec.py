@@ -0,0 +1,40 @@
+""" JSON encoding and decoding for the app.
+Uses `orjson` when installed, otherwise the standard library. Decodes directly from bytes."""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError is its subclass
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """ Decodes JSON from bytes or a string"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """ Encodes an object to a compact JSON string"""
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """ Encodes an object to compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def dumps_pretty(obj: Any) -> bytes:
+    """ Encodes an object to UTF-8 JSON bytes indented for humans"""
+    if orjson is not None:
+        return orjson.dumps(obj,
+                            option=orjson.OPT_INDENT_2
+                            | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2).encode('utf-8')
@@ -6,6 +6,8 @@ from typing import Any, Callable, Dict
 
 import appdirs
 
+import overlay.json_codec as json_codec
+
 CONFIG_FOLDER = os.path.join(appdirs.user_data_dir(), "AoE4_Overlay")
 LOG_FILE = os.path.join(CONFIG_FOLDER, 'overlay.log')
 MATCH_LOG_FILE = os.path.join(CONFIG_FOLDER, 'matches.log')
@@ -37,7 +39,7 @@ def log_match(match: Dict[str, Any]):
     try:
         now = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         with open(MATCH_LOG_FILE, 'a') as f:
-            f.write(f"{now} | {match}\n")
+            f.write(f"{now} | {json_codec.dumps(match)}\n")
     except Exception:
         ...
 
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+import overlay.json_codec as json_codec
+from overlay.logging_func import CONFIG_FOLDER, get_logger
+
+logger = get_logger(__name__)
+MATCH_DB_FILE = os.path.join(CONFIG_FOLDER, "match_history.sqlite")
+
+
+class _MatchStore:
+    """ Local SQLite store of finished games from players' match history.
+
+    Games are keyed by `game_id` (per profile), the raw API data is kept as JSON."""
+
+    def __init__(self, path: str = MATCH_DB_FILE):
+        self.path = path
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS games ("
+                         "profile_id INTEGER NOT NULL, "
+                         "game_id INTEGER NOT NULL, "
+                         "started_at TEXT NOT NULL, "
+                         "data TEXT NOT NULL, "
+                         "PRIMARY KEY (profile_id, game_id))")
+            # How far the match history was synced without gaps
+            conn.execute("CREATE TABLE IF NOT EXISTS sync_state ("
+                         "profile_id INTEGER PRIMARY KEY, "
+                         "synced_through TEXT NOT NULL)")
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """ Opens a new connection, so the store can be used from any thread"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_games(self, profile_id: int) -> List[Any]:
+        """ Returns stored games for the profile, newest first"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT data FROM games WHERE profile_id = ? "
+                "ORDER BY started_at DESC", (profile_id, )).fetchall()
+        return [json_codec.loads(row[0]) for row in rows]
+
+    def synced_through(self, profile_id: int) -> Optional[str]:
+        """ Returns `started_at` up to which all games of the profile are stored"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT synced_through FROM sync_state WHERE profile_id = ?",
+                (profile_id, )).fetchone()
+        return row[0] if row else None
+
+    def set_synced_through(self, profile_id: int, started_at: str):
+        """ Moves the sync point, only after all games before it were stored"""
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state "
+                "(profile_id, synced_through) VALUES (?, ?)",
+                (profile_id, started_at))
+
+    def add_games(self, profile_id: int, games: List[Any]):
+        """ Stores finished games. Ongoing games are skipped as they will change."""
+        rows = [(profile_id, game['game_id'], game['started_at'],
+                 json_codec.dumps(game)) for game in games
+                if not game.get('ongoing')]
+        if not rows:
+            return
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO games "
+                "(profile_id, game_id, started_at, data) VALUES (?, ?, ?, ?)",
+                rows)
+        logger.info(f"Stored {len(rows)} games for profile {profile_id}")
+
+
+match_store = _MatchStore()
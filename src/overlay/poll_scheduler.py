@@ -0,0 +1,115 @@
+import random
+import statistics
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from overlay.logging_func import get_logger
+from overlay.settings import settings
+
+logger = get_logger(__name__)
+
+MIN_INTERVAL = 3  # Seconds
+MAX_INTERVAL = 120
+REQUEUE_WINDOW = 5 * 60  # A new game is likely this soon after the last one
+IDLE_AFTER = 30 * 60
+LONG_IDLE_AFTER = 2 * 60 * 60
+DEFAULT_GAME_LENGTH = 20 * 60
+JITTER = 0.1
+
+
+class PollScheduler:
+    """ Decides how long to wait before the next check for a new game.
+
+    Polls quickly after a game ends (requeue is likely), backs off during a game
+    based on the typical game length and backs off further while idle."""
+
+    def __init__(self, profile_id: int):
+        self.profile_id = profile_id
+        self.typical_game_length: float = DEFAULT_GAME_LENGTH
+        self.reset()
+
+    def reset(self):
+        """ Resets the state (e.g. for a new profile)"""
+        self.game_started: Optional[float] = None  # Start of an ongoing game
+        self.game_ended: Optional[float] = None  # End of the last game
+        self.last_activity: float = time.time()
+        self.state: str = ""
+        # Recent decisions as (time, interval, reason)
+        self.decisions: Deque[Tuple[float, float, str]] = deque(maxlen=50)
+
+    def observe_game(self, game: Dict[str, Any]):
+        """ Updates the state with the last game returned by the API"""
+        started = game['started_sec']
+        if game.get('ongoing'):
+            self.game_started = started
+            self.last_activity = max(self.last_activity, started)
+            return
+
+        if game.get('duration'):
+            ended = started + game['duration']
+        elif self.game_started is not None:
+            ended = time.time()
+        else:
+            ended = started
+        self.game_started = None
+        self.game_ended = max(self.game_ended or 0, ended)
+        self.last_activity = max(self.last_activity, ended)
+
+    def update_history(self, match_history: List[Any]):
+        """ Updates typical game length from player's match history"""
+        durations = [
+            match['duration'] for match in match_history[:50]
+            if not match.get('ongoing') and match.get('duration')
+        ]
+        if len(durations) < 5:
+            return
+        self.typical_game_length = statistics.median(durations)
+
+    def next_interval(self) -> float:
+        """ Returns the number of seconds to wait before the next check"""
+        now = time.time()
+        base = settings.interval
+
+        if (self.game_started is not None
+                and now - self.game_started > 3 * self.typical_game_length):
+            # Most likely an abandoned game that never got a result
+            self.game_started = None
+
+        if self.game_started is not None:
+            remaining = self.game_started + self.typical_game_length - now
+            state = "in game"
+            if remaining > 2 * base:
+                interval = remaining / 2
+                reason = f"expected to end in {remaining/60:.0f} min"
+            else:
+                interval = base
+                reason = "might end soon"
+        elif (self.game_ended is not None
+              and now - self.game_ended < REQUEUE_WINDOW):
+            state = "game ended"
+            interval = base / 3
+            reason = f"ended {(now - self.game_ended)/60:.0f} min ago"
+        elif now - self.last_activity > LONG_IDLE_AFTER:
+            state = "idle"
+            interval = base * 4
+            reason = f"no game for {(now - self.last_activity)/3600:.0f} h"
+        elif now - self.last_activity > IDLE_AFTER:
+            state = "idle"
+            interval = base * 2
+            reason = f"no game for {(now - self.last_activity)/60:.0f} min"
+        else:
+            state = "default"
+            interval = base
+            reason = "no recent game data"
+
+        interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+        interval *= random.uniform(1 - JITTER, 1 + JITTER)
+
+        if state != self.state:
+            logger.info(
+                f"Checking for new games of {self.profile_id} every ~{interval:.0f}s ({state}: {reason})"
+            )
+        self.state = state
+        self.decisions.append((now, interval, f"{state}: {reason}"))
+        return interval
@@ -0,0 +1,127 @@
+""" Background asyncio runtime for the websocket server, game polling and timers.
+
+Everything outside the Qt main thread runs in one event loop. Blocking calls (`requests`)
+run in a small executor through `run_blocking`. Results go to the Qt side through one
+signal (`Runtime.emit` on any thread, handlers added with `Runtime.connect`)."""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from PyQt5 import QtCore
+
+from overlay.http_client import LatencyMetrics
+from overlay.logging_func import get_logger
+
+logger = get_logger(__name__)
+
+
+class Runtime(QtCore.QObject):
+    """ Runs an asyncio event loop in a background thread"""
+    event = QtCore.pyqtSignal(str, object, float)
+
+    def __init__(self, blocking_workers: int = 2):
+        super().__init__()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.executor = ThreadPoolExecutor(max_workers=blocking_workers,
+                                           thread_name_prefix="runtime")
+        self.handlers: Dict[str, Callable[[Any], None]] = {}
+        # Durations of blocking calls and delays of events reaching the Qt side
+        self.metrics = LatencyMetrics()
+        self.event.connect(self._dispatch)
+
+    def start(self):
+        """ Starts the event loop and waits until it runs"""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       args=(ready, ),
+                                       name="runtime",
+                                       daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def _run(self, ready: threading.Event):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(ready.set)
+        try:
+            self.loop.run_forever()
+        except Exception:
+            logger.exception("Runtime stopped")
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        self.log_summary()
+
+    def log_summary(self):
+        """ Logs durations of blocking calls and delays of events"""
+        for name, data in self.metrics.summary().items():
+            count = "events" if name == "event delay" else "calls"
+            logger.info(
+                f"{name}: {data['requests']} {count} ({data['errors']} errors) | "
+                f"p50 {data['p50']:.0f} ms | p95 {data['p95']:.0f} ms | max {data['max']:.0f} ms"
+            )
+
+    def submit(self, coroutine: Awaitable) -> Future:
+        """ Runs a coroutine in the event loop (thread-safe), errors are logged"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(self._log_error)
+        return future
+
+    @staticmethod
+    def _log_error(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Runtime task failed",
+                         exc_info=future.exception())
+
+    async def run_blocking(self, fn: Callable, *args, **kwargs) -> Any:
+        """ Runs a blocking function in the executor and records its duration"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await self.loop.run_in_executor(
+                self.executor, partial(fn, *args, **kwargs))
+            ok = True
+            return result
+        finally:
+            self.metrics.record(fn.__name__, time.perf_counter() - start, ok)
+
+    def connect(self, name: str, handler: Callable[[Any], None]):
+        """ Adds a handler for events with given name (called in the Qt main thread)"""
+        self.handlers[name] = handler
+
+    def emit(self, name: str, payload: Any = None):
+        """ Passes an event to the Qt main thread (thread-safe)"""
+        self.event.emit(name, payload, time.perf_counter())
+
+    def _dispatch(self, name: str, payload: Any, emitted: float):
+        self.metrics.record("event delay", time.perf_counter() - emitted,
+                            True)
+        self.handlers[name](payload)
+
+
+async def detect_wake(callback: Callable[[float], None], interval: float = 10):
+    """ Calls `callback` with the time the PC was asleep (seconds) after it wakes up.
+    Sleep shows as the loop waking up much later than it should have."""
+    while True:
+        start = time.time()
+        await asyncio.sleep(interval)
+        diff = time.time() - start
+        if diff > interval + 5:
+            # Give the network some time to come back
+            await asyncio.sleep(4)
+            callback(diff - interval)
+
+
+async def every(interval: float, callback: Callable[[], None]):
+    """ Calls `callback` every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            callback()
+        except Exception:
+            logger.exception("")
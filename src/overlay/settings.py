@@ -1,7 +1,7 @@
-import json
 import os
 from typing import Dict, List, Optional
 
+import overlay.json_codec as json_codec
 from overlay.logging_func import CONFIG_FOLDER, get_logger
 
 logger = get_logger(__name__)
@@ -20,6 +20,7 @@ class _Settings:
         self.steam_id: Optional[int] = None
         self.profile_id: Optional[int] = None
         self.player_name: Optional[str] = None
+        self.watched_profiles: List[int] = []  # Other profiles to check for new games
         self.overlay_hotkey: str = ""
         self.overlay_geometry: Optional[List[int]] = None
         self.font_size: int = 12
@@ -82,7 +83,7 @@ class _Settings:
             return
         try:
             with open(CONFIG_FILE, 'rb') as f:
-                data = json.loads(f.read())
+                data = json_codec.loads(f.read())
         except Exception:
             logger.warning("Failed to parse config file")
             return
@@ -92,8 +93,8 @@ class _Settings:
 
     def save(self):
         """ Saves configuration to app data"""
-        with open(CONFIG_FILE, 'w') as f:
-            f.write(json.dumps(self.__dict__, indent=2))
+        with open(CONFIG_FILE, 'wb') as f:
+            f.write(json_codec.dumps_pretty(self.__dict__))
 
 
 settings = _Settings()
@@ -0,0 +1,134 @@
+""" Serves the overlay (`html/` and `img/`) over HTTP from the websocket server.
+
+Files are kept in memory with a strong ETag (content hash) and a gzipped copy for text.
+Libraries and images are cached for an hour, the rest is revalidated (304) on every load."""
+import gzip
+import hashlib
+import http
+import mimetypes
+import os
+import stat
+import urllib.parse
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from websockets.datastructures import Headers
+
+from overlay.helper_func import file_path
+
+# URL prefix and directory served under it
+DIRECTORIES = {"html": file_path("html"), "img": file_path("img")}
+INDEX = "/html/overlay.html"
+# Files that rarely change. Their URLs aren't versioned, so they are revalidated after
+# an hour to pick up changes from app updates.
+CACHED = ("/html/jquery.min.js", "/img/")
+CACHED_MAX_AGE = 3600
+TEXT_TYPES = ("text/", "application/javascript", "application/json",
+              "image/svg+xml")
+CONTENT_TYPES = {".webp": "image/webp", ".js": "application/javascript"}
+
+HTTPResponse = Tuple[http.HTTPStatus, List[Tuple[str, str]], bytes]
+
+
+class _File(NamedTuple):
+    mtime: float
+    size: int
+    content_type: str
+    etag: str
+    body: bytes
+    gzipped: Optional[bytes]  # Only for text, if it's smaller
+
+
+def content_type(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    file_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(
+        path)[0] or "application/octet-stream"
+    if file_type.startswith(TEXT_TYPES):
+        file_type += "; charset=utf-8"
+    return file_type
+
+
+class StaticFiles:
+    """ Files served over HTTP, use `process_request` with the websocket server"""
+    def __init__(self, directories: Dict[str, str] = DIRECTORIES):
+        self.directories = {
+            prefix: os.path.realpath(directory)
+            for prefix, directory in directories.items()
+        }
+        self.files: Dict[str, _File] = {}
+
+    def local_path(self, url_path: str) -> Optional[str]:
+        """ Returns the file for an URL path, `None` if it's outside served directories"""
+        parts = url_path.lstrip("/").split("/", 1)
+        if len(parts) != 2 or parts[0] not in self.directories:
+            return None
+        directory = self.directories[parts[0]]
+        path = os.path.realpath(os.path.join(directory, parts[1]))
+        if os.path.commonpath((directory, path)) != directory:
+            return None
+        return path
+
+    def load(self, path: str) -> Optional[_File]:
+        """ Returns the file from the cache, reads it again if it changed"""
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        cached = self.files.get(path)
+        if cached and (cached.mtime, cached.size) == (file_stat.st_mtime,
+                                                       file_stat.st_size):
+            return cached
+
+        with open(path, "rb") as f:
+            body = f.read()
+        file_type = content_type(path)
+        gzipped = None
+        if file_type.startswith(TEXT_TYPES):
+            gzipped = gzip.compress(body, mtime=0)
+            if len(gzipped) >= len(body):
+                gzipped = None
+        etag = hashlib.sha1(body).hexdigest()[:16]
+        self.files[path] = _File(file_stat.st_mtime, file_stat.st_size,
+                                 file_type, etag, body, gzipped)
+        return self.files[path]
+
+    async def process_request(self, path: str,
+                              request_headers: Headers) -> Optional[HTTPResponse]:
+        """ Answers HTTP requests, returns `None` for websocket handshakes"""
+        if request_headers.get("Upgrade", "").lower() == "websocket":
+            return None
+
+        url = urllib.parse.urlsplit(path)
+        url_path = urllib.parse.unquote(url.path)
+        if url_path in ("", "/"):
+            location = INDEX + (f"?{url.query}" if url.query else "")
+            return http.HTTPStatus.FOUND, [("Location", location)], b""
+
+        local_path = self.local_path(url_path)
+        cached = self.load(local_path) if local_path else None
+        if cached is None:
+            return http.HTTPStatus.NOT_FOUND, [("Content-Type", "text/plain")
+                                               ], b"Not found"
+
+        use_gzip = cached.gzipped is not None and "gzip" in request_headers.get(
+            "Accept-Encoding", "")
+        # Each encoding is a different representation with its own strong ETag
+        etag = f'"{cached.etag}-gz"' if use_gzip else f'"{cached.etag}"'
+        headers = [("ETag", etag)]
+        if url_path.startswith(CACHED):
+            headers.append(("Cache-Control", f"max-age={CACHED_MAX_AGE}"))
+        else:
+            headers.append(("Cache-Control", "no-cache"))
+        if cached.gzipped is not None:
+            headers.append(("Vary", "Accept-Encoding"))
+
+        if_none_match = request_headers.get("If-None-Match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            return http.HTTPStatus.NOT_MODIFIED, headers, b""
+
+        headers.append(("Content-Type", cached.content_type))
+        if use_gzip:
+            headers.append(("Content-Encoding", "gzip"))
+            return http.HTTPStatus.OK, headers, cached.gzipped
+        return http.HTTPStatus.OK, headers, cached.body
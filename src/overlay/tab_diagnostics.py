@@ -0,0 +1,114 @@
+from typing import Sequence, Tuple
+
+from PyQt5 import QtCore, QtWidgets
+
+from overlay.websocket import Websocket_manager
+from overlay.worker import job_summary, pool_status
+
+COLUMNS = ("Client", "Topics", "Connected", "Lag", "Messages", "Drops",
+           "Sent", "Ping")
+JOB_COLUMNS = ("Function", "Runs", "Errors", "Cancelled", "Queued p50",
+               "Queued p95", "Run p50", "Run p95", "Run max")
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.0f} GB"
+
+
+class DiagnosticsTab(QtWidgets.QWidget):
+    """ Shows connected websocket clients and their health, and background jobs
+    (queue and run times by function).
+    Refreshed only while the tab is visible."""
+
+    def __init__(self, parent, websocket_manager: Websocket_manager):
+        super().__init__(parent)
+        self.websocket_manager = websocket_manager
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.initUI()
+
+    def initUI(self):
+        main_layout = QtWidgets.QVBoxLayout()
+        main_layout.setContentsMargins(10, 10, 10, 5)
+        main_layout.setAlignment(QtCore.Qt.AlignTop)
+        self.setLayout(main_layout)
+
+        ### Websocket clients
+        clients_frame = QtWidgets.QGroupBox("Websocket clients")
+        main_layout.addWidget(clients_frame)
+        layout = QtWidgets.QVBoxLayout()
+        clients_frame.setLayout(layout)
+
+        self.clients = self.create_table(COLUMNS)
+        layout.addWidget(self.clients)
+
+        ### Background work
+        work_frame = QtWidgets.QGroupBox("Background work")
+        main_layout.addWidget(work_frame)
+        layout = QtWidgets.QVBoxLayout()
+        work_frame.setLayout(layout)
+
+        self.pool = QtWidgets.QLabel()
+        layout.addWidget(self.pool)
+        self.jobs = self.create_table(JOB_COLUMNS)
+        layout.addWidget(self.jobs)
+
+    @staticmethod
+    def create_table(columns: Tuple[str, ...]) -> QtWidgets.QTableWidget:
+        table = QtWidgets.QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        table.verticalHeader().hide()
+        table.horizontalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.ResizeToContents)
+        return table
+
+    @staticmethod
+    def set_row(table: QtWidgets.QTableWidget, row: int,
+                values: Sequence[str]):
+        """ Sets texts of a row, items are changed only when their text changes"""
+        for column, value in enumerate(values):
+            item = table.item(row, column)
+            if item is None:
+                table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+            elif item.text() != value:
+                item.setText(value)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
+
+    def refresh(self):
+        pool = pool_status()
+        self.pool.setText(
+            f"Thread pool: {pool['busy']} of {pool['threads']} threads busy, "
+            f"{pool['queued']} jobs queued")
+        jobs = job_summary()
+        self.jobs.setRowCount(len(jobs))
+        for row, (name, job) in enumerate(sorted(jobs.items())):
+            self.set_row(self.jobs, row,
+                         (name, str(job['runs']), str(job['errors']),
+                          str(job['cancelled']), f"{job['queue_p50']:.0f} ms",
+                          f"{job['queue_p95']:.0f} ms", f"{job['p50']:.0f} ms",
+                          f"{job['p95']:.0f} ms", f"{job['max']:.0f} ms"))
+
+        clients = self.websocket_manager.clients_info()
+        self.clients.setRowCount(len(clients))
+        for row, client in enumerate(clients):
+            rtt = "–" if client['rtt'] is None else f"{client['rtt'] * 1000:.1f} ms"
+            self.set_row(self.clients, row,
+                         (client['name'], client['topics'],
+                          f"{client['connected'] / 60:.0f} min",
+                          str(client['lag']), str(client['messages']),
+                          str(client['drops']), format_bytes(client['bytes']),
+                          rtt))
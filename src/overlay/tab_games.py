@@ -56,10 +56,10 @@ class MatchEntry:
         map_name = QtWidgets.QLabel(match_data.get('map', "Unknown map"))
 
         # Date
-        started = datetime.strptime(match_data['started_at'],
-                                    "%Y-%m-%dT%H:%M:%S.000Z")
+        self.started = datetime.strptime(match_data['started_at'],
+                                         "%Y-%m-%dT%H:%M:%S.000Z")
 
-        date = QtWidgets.QLabel(started.strftime("%b %d, %H:%M:%S"))
+        date = QtWidgets.QLabel(self.started.strftime("%b %d, %H:%M:%S"))
 
         # Mode
         mode = QtWidgets.QLabel(match_data['kind'])
@@ -112,7 +112,7 @@ class MatchHistoryTab(QtWidgets.QWidget):
 
     def __init__(self, parent):
         super().__init__(parent)
-        # List of added matches. New ones at the end.
+        # List of added matches sorted by start. New ones at the end.
         self.matches: List[MatchEntry] = []
 
         # Scroll content
@@ -166,6 +166,8 @@ class MatchHistoryTab(QtWidgets.QWidget):
 
     @catch_exceptions(logger)
     def update_widgets(self, match_history: List[Any]):
+        """ Adds games to the tab. Can be called repeatedly with batches of games
+        in any order (e.g. pages of match history as they are downloaded)."""
         # Remove widgets from the layout
         self.clear_scroll_layout()
 
@@ -178,6 +180,7 @@ class MatchHistoryTab(QtWidgets.QWidget):
             if match['game_id'] in present_game_ids:
                 continue
             self.matches.append(MatchEntry(self.scroll_layout, match))
+        self.matches.sort(key=lambda match_entry: match_entry.started)
 
         # Re-add widgets to the layout
         added_rows = 1  # With header
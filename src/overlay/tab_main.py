@@ -1,29 +1,38 @@
 import importlib
 import platform
-import time
+import threading
 import webbrowser
 from functools import partial
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Tuple
 
 import keyboard
 from PyQt5 import QtWidgets
 
 import overlay.helper_func as hf
-from overlay.api_checking import Api_checker, get_full_match_history
+import overlay.http_client as http_client
+import overlay.worker as worker
+from overlay.api_checking import Api_checker, sync_match_history
+from overlay.coalescer import Coalescer
 from overlay.logging_func import get_logger, log_match
+from overlay.match_store import match_store
+from overlay.runtime import Runtime, detect_wake, every
 from overlay.settings import settings
 from overlay.tab_build_orders import BoTab
+from overlay.tab_diagnostics import DiagnosticsTab
 from overlay.tab_games import MatchHistoryTab
 from overlay.tab_graphs import GraphTab
 from overlay.tab_override import OverrideTab
 from overlay.tab_random import RandomTab
 from overlay.tab_settings import SettingsTab
 from overlay.tab_stats import StatsTab
+from overlay.watchdog import Watchdog
 from overlay.websocket import Websocket_manager
-from overlay.worker import scheldule
+from overlay.worker import USER, cancel_job, scheldule
 
 logger = get_logger(__name__)
 
+JOB_SUMMARY_INTERVAL = 600  # Seconds between logged summaries of background jobs
+
 
 class TabWidget(QtWidgets.QTabWidget):
 
@@ -31,9 +40,18 @@ class TabWidget(QtWidgets.QTabWidget):
         super().__init__(parent)
         self.version = version
         self.api_checker = Api_checker()
+        # Websocket server, game polling and wake detection run here
+        self.runtime = Runtime()
+        self.runtime.connect("new_game", self.new_game)
+        self.runtime.connect("watched_game", self.new_watched_game)
+        self.runtime.connect("woke", self.pc_waken_from_sleep)
         self.websocket_manager = Websocket_manager(settings.websocket_port)
-        self.force_stop: bool = False
+        self.stop_event = threading.Event()
         self.prevent_overlay_update: bool = False
+        # Bursts of overlay updates are merged into one per frame
+        self.overlay_updates = Coalescer(self.update_overlays)
+        # Logs blocking calls in the Qt main thread
+        self.watchdog = Watchdog()
 
         self.games_tab = MatchHistoryTab(self)
         # self.graph_tab = GraphTab(self)
@@ -45,6 +63,7 @@ class TabWidget(QtWidgets.QTabWidget):
         self.override_tab.update_override.connect(self.override_update_event)
         self.settigns_tab = SettingsTab(self)
         self.settigns_tab.new_profile.connect(self.new_profile_found)
+        self.diagnostics_tab = DiagnosticsTab(self, self.websocket_manager)
 
         self.addTab(self.settigns_tab, "Settings")
         self.addTab(self.games_tab, "Games")
@@ -53,18 +72,27 @@ class TabWidget(QtWidgets.QTabWidget):
         self.addTab(self.build_order_tab, "Build orders")
         self.addTab(self.random_tab, "Randomize")
         self.addTab(self.override_tab, "Override")
+        self.addTab(self.diagnostics_tab, "Diagnostics")
 
     def start(self):
         logger.info(
             f"Starting (v{self.version}) (compiled:{hf.is_compiled()}) [{platform.platform()}]"
         )
+        self.watchdog.start()
+        # Network work runs concurrently in the background, results are applied as they come
+        self.runtime.start()
+        self.runtime.submit(
+            self.api_checker.poll(self.runtime.run_blocking,
+                                  self.runtime.emit))
+        self.runtime.submit(self.websocket_manager.serve())
+        scheldule(None, http_client.warm_up)
         self.check_for_new_version()
         hf.create_custom_files()
         self.settigns_tab.start()
-        self.run_new_game_check()
-        self.websocket_manager.run()
         self.send_ws_colors()
-        self.check_waking()
+        self.runtime.submit(
+            detect_wake(partial(self.runtime.emit, "woke")))
+        self.runtime.submit(every(JOB_SUMMARY_INTERVAL, worker.log_summary))
 
     def closeEvent(self, _):
         """Function called when closing the widget."""
@@ -76,40 +104,52 @@ class TabWidget(QtWidgets.QTabWidget):
         # self.stats_tab.run_mode_update()
         # self.stats_tab.clear_match_data()
         self.games_tab.clear_games()
-        self.update_with_match_history_data(10000)
+        # Games of the previous profile shouldn't show up
+        cancel_job("match_history_sync")
+        scheldule(self.got_local_match_history,
+                  match_store.get_games,
+                  settings.profile_id,
+                  key="local_match_history",
+                  priority=USER)
         self.parent().update_title(settings.player_name)
 
-    def update_with_match_history_data(self, amount: int):
-        """ Gets match history and updates games tab and passes data to stats tab"""
-        scheldule(self.got_match_history, get_full_match_history, amount)
+    def got_local_match_history(self, match_history: List[Any]):
+        """ Shows stored match history and then syncs new games"""
+        if match_history:
+            self.api_checker.scheduler.update_history(match_history)
+            self.games_tab.update_widgets(match_history)
+        self.update_with_match_history_data()
+
+    def update_with_match_history_data(self):
+        """ Syncs new games to the local store and updates games tab and passes data to stats tab"""
+        scheldule(self.got_match_history,
+                  sync_match_history,
+                  settings.profile_id,
+                  progress_callback=self.games_tab.update_widgets,
+                  key="match_history_sync",
+                  cancellable=True)
 
     def got_match_history(self, match_history: List[Any]):
+        """ All new games were synced (games tab is updated with each page)"""
         if match_history is None:
             self.settigns_tab.aoe4net_error_msg()
             logger.warning("No match history data")
             return
         self.settigns_tab.message("")
+        self.api_checker.scheduler.update_history(match_history)
         # self.stats_tab.update_other_stats(match_history)
-        self.games_tab.update_widgets(match_history)
-
-    def run_new_game_check(self, delayed_seconds: int = 0):
-        """ Creates a new thread for a new api check"""
-        scheldule(self.new_game, self.api_checker.check_for_new_game,
-                  delayed_seconds)
 
-    def new_game(self, game_data: Optional[Dict[str, Any]]):
-        """Received new data from api check, passes data along and reruns the check"""
-        if self.force_stop:
+    def new_game(self, game_data: Dict[str, Any]):
+        """Received new data from api check, passes data along"""
+        if self.stop_event.is_set():
             return
 
-        if game_data is None:
-            pass
-        elif "new_rating" in game_data:
+        if "new_rating" in game_data:
             logger.info(
                 f"Game finished (rating_timestamp: {game_data['timestamp']})")
             # self.graph_tab.run_update()
             # self.stats_tab.run_mode_update()
-            self.update_with_match_history_data(2)
+            self.update_with_match_history_data()
 
         elif 'server_down' in game_data:
             self.settigns_tab.aoe4net_error_msg()
@@ -122,23 +162,45 @@ class TabWidget(QtWidgets.QTabWidget):
             )
             self.override_tab.update_data(processed)
             if not self.prevent_overlay_update:
-                self.settigns_tab.overlay_widget.update_data(processed)
-                self.websocket_manager.send({
-                    "type": "player_data",
-                    "data": processed
-                })
+                self.overlay_updates.push(processed)
 
-        self.run_new_game_check(delayed_seconds=30)
+    def new_watched_game(self, new_game: Tuple[int, Dict[str, Any]]):
+        """ Received a new game of a watched profile, sends it to the websocket under its profile"""
+        profile_id, game_data = new_game
+        if self.stop_event.is_set():
+            return
+        if settings.log_matches:
+            log_match(game_data)
+        processed = hf.process_game(game_data, profile_id)
+        logger.info(
+            f"New live game of watched profile {profile_id} (game_id: {game_data['game_id']} | mode: {game_data['kind']})"
+        )
+        self.websocket_manager.send({
+            "type": "profile_data",
+            "profile_id": profile_id,
+            "data": processed
+        })
 
     def stop_checking_api(self):
         """ The app is closing, we need to start shuttings things down"""
-        self.force_stop = True
+        self.stop_event.set()
         self.api_checker.force_stop = True
+        logger.info(f"Last game checks: {self.api_checker.parse_stats()}")
+        http_client.metrics.log_summary()
+        worker.log_summary()
+        self.runtime.stop()
+        self.watchdog.stop()
 
     def check_for_new_version(self):
-        """ Checks for a new version, creates a button if there is one """
-        link = hf.version_check(self.version)
-        if not link:
+        """ Checks for a new version in the background"""
+        scheldule(self.show_update_button,
+                  hf.version_check,
+                  self.version,
+                  key="version_check")
+
+    def show_update_button(self, link: str):
+        """ Shows a button linking to the new version (if there is one)"""
+        if not link or not self.settigns_tab.update_button.isHidden():
             return
         logger.info("New version available!")
         self.settigns_tab.update_button.clicked.connect(
@@ -146,6 +208,10 @@ class TabWidget(QtWidgets.QTabWidget):
         self.settigns_tab.update_button.show()
 
     def override_event(self, data: Dict[str, Any]):
+        self.overlay_updates.push(data)
+
+    def update_overlays(self, data: Dict[str, Any]):
+        """ Updates the overlay and the websocket overlay with new player data"""
         self.settigns_tab.overlay_widget.update_data(data)
         self.websocket_manager.send({"type": "player_data", "data": data})
 
@@ -160,35 +226,15 @@ class TabWidget(QtWidgets.QTabWidget):
 
     ### Functionality dedicated to checking for PC waking, and resetting keyboard threads
 
-    def check_waking(self):
-        """ Manages all checks and keyboard resets"""
-        scheldule(self.pc_waken_from_sleep, self.wait_for_wake)
-
-    def wait_for_wake(self):
-        """ Function that checks for a interruption"""
-        interval = 10  # Seconds
-        while True:
-            start = time.time()
-            # Wait 5s
-            for _ in range(interval * 2):
-                time.sleep(0.5)
-                if self.force_stop:
-                    return None
-            # Check the difference
-            diff = time.time() - start
-            if diff > interval + 5:
-                time.sleep(4)
-                return diff - interval
-
-    def pc_waken_from_sleep(self, diff: Optional[float]):
-        """ This function is run when the PC is awoken """
-        if diff is None:
+    def pc_waken_from_sleep(self, diff: float):
+        """ This function is run when the PC is awoken (see `detect_wake`)"""
+        if self.stop_event.is_set():
             return
 
         logger.info(f'PC awoke! ({hf.strtime(diff, show_seconds=True)})')
-        self.check_waking()
 
-        # Check for new updates & reset keyboard threads
+        # Reopen connection, check for new updates & reset keyboard threads
+        scheldule(None, http_client.warm_up)
         self.check_for_new_version()
         self.reset_keyboard_threads()
 
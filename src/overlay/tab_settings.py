@@ -1,16 +1,17 @@
-import json
 from types import TracebackType
 from typing import Tuple, Type
 
 import keyboard
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+import overlay.http_client as http_client
+import overlay.json_codec as json_codec
 from overlay.api_checking import find_player
 from overlay.custom_widgets import CustomKeySequenceEdit
 from overlay.logging_func import get_logger
 from overlay.overlay_widget import AoEOverlay
 from overlay.settings import settings
-from overlay.worker import scheldule
+from overlay.worker import USER, scheldule
 
 logger = get_logger(__name__)
 
@@ -18,12 +19,17 @@ logger = get_logger(__name__)
 class SettingsTab(QtWidgets.QWidget):
     new_profile = QtCore.pyqtSignal()
     show_hide_overlay = QtCore.pyqtSignal()
+    api_status_changed = QtCore.pyqtSignal(str)
 
     def __init__(self, parent):
         super().__init__(parent)
         self.overlay_widget = AoEOverlay()
         self.init_UI()
         self.show_hide_overlay.connect(self.overlay_widget.show_hide)
+        # The governor calls this from worker threads, signal passes it to the main thread
+        self.api_status_changed.connect(self.update_api_status)
+        http_client.governor(http_client.AOE4WORLD_HOST).add_listener(
+            self.api_status_changed.emit)
 
     def init_UI(self):
         # Layout
@@ -77,6 +83,26 @@ class SettingsTab(QtWidgets.QWidget):
         self.notification_label = QtWidgets.QLabel()
         profile_box_layout.addWidget(self.notification_label, 3, 0)
 
+        # AoE4 World API status
+        self.api_status = QtWidgets.QLabel()
+        self.api_status.setToolTip(
+            "Requests are paused while AoE4 World is unavailable or rate limiting"
+        )
+        profile_box_layout.addWidget(self.api_status, 4, 0, 1, 2)
+
+        # Watched profiles
+        self.watched_profiles = QtWidgets.QLineEdit(", ".join(
+            str(i) for i in settings.watched_profiles))
+        self.watched_profiles.setPlaceholderText("Watched profile IDs")
+        self.watched_profiles.setToolTip(
+            'Profile IDs of other players to check for new games (separated by commas).\n'
+            'Show them on the streaming overlay with "overlay.html?profile=<profile ID>".'
+        )
+        self.watched_profiles.setMaximumWidth(220)
+        self.watched_profiles.editingFinished.connect(
+            self.watched_profiles_changed)
+        profile_box_layout.addWidget(self.watched_profiles, 5, 0)
+
         ### Overlay box
         overlay_box = QtWidgets.QGroupBox("Overlay")
         overlay_box.setMinimumSize(400, 100)
@@ -180,6 +206,12 @@ class SettingsTab(QtWidgets.QWidget):
         self.notification_label.setText(text)
         self.notification_label.setStyleSheet(f"color: {color}")
 
+    def update_api_status(self, status: str):
+        """ Shows the state of requests to AoE4 World"""
+        self.api_status.setText(f"AoE4 World API: {status}")
+        self.api_status.setStyleSheet(
+            "color: gray" if status == "ok" else "color: red")
+
     def message(self, text: str, color: str = "black"):
         """ Shows a message"""
         self.msg.setText(text)
@@ -202,14 +234,17 @@ class SettingsTab(QtWidgets.QWidget):
         scheldule(self.find_profile_finish,
                   find_player,
                   text,
-                  error_callback=self.error_when_finding_profile)
+                  error_callback=self.error_when_finding_profile,
+                  key="find_player",
+                  priority=USER,
+                  cancellable=True)
 
     def error_when_finding_profile(self,
                                    exc_data: Tuple[Type[BaseException],
                                                    Exception, TracebackType]):
         """ Decoding error when finding player profile indicates an issue with AoEIV.net"""
         exctype, value, formatted = exc_data
-        if exctype == json.decoder.JSONDecodeError:
+        if issubclass(exctype, json_codec.JSONDecodeError):
             self.aoe4net_error_msg()
             logger.warning(
                 f"Decoding error when finding a player\n{formatted}")
@@ -224,6 +259,17 @@ class SettingsTab(QtWidgets.QWidget):
         else:
             self.notification("Failed to find such player!", "red")
 
+    def watched_profiles_changed(self):
+        profile_ids = []
+        for item in self.watched_profiles.text().split(","):
+            item = item.strip()
+            if item.isdigit() and int(item) not in profile_ids:
+                profile_ids.append(int(item))
+        self.watched_profiles.setText(", ".join(str(i) for i in profile_ids))
+        if profile_ids != settings.watched_profiles:
+            settings.watched_profiles = profile_ids
+            logger.info(f"Watched profiles: {profile_ids}")
+
     def font_size_changed(self):
         font_size = self.font_size_combo.currentIndex() + 1
         settings.font_size = font_size
@@ -0,0 +1,89 @@
+""" Detects stalls of the Qt event loop and logs what the main thread was doing.
+
+An application event filter notes when the loop starts handling events after being idle,
+and the event dispatcher signals when it has nothing left to do (`aboutToBlock`). A watchdog
+thread waits for the loop to get busy and then for it to get idle again. When that takes
+longer than the threshold, the stack of the main thread is captured and logged with the
+stall duration once the loop runs again.
+There are no periodic wakeups, the thread sleeps while the loop is idle."""
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from PyQt5 import QtCore
+
+from overlay.logging_func import get_logger
+
+logger = get_logger(__name__)
+
+STALL_THRESHOLD = 0.5  # Seconds the loop can be busy without going idle
+LONG_STALL = 10  # Seconds, logged before the loop runs again
+
+
+class Watchdog(QtCore.QObject):
+    """ Has to be created and started in the Qt main thread"""
+
+    def __init__(self, threshold: float = STALL_THRESHOLD):
+        super().__init__()
+        self.threshold = threshold
+        self.main_thread = threading.get_ident()
+        self.busy = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.busy_since = time.monotonic()
+        self.stop_event = threading.Event()
+        self.dispatcher: Optional[QtCore.QAbstractEventDispatcher] = None
+
+    def start(self):
+        self.dispatcher = QtCore.QAbstractEventDispatcher.instance()
+        self.dispatcher.aboutToBlock.connect(self._about_to_block)
+        QtCore.QCoreApplication.instance().installEventFilter(self)
+        threading.Thread(target=self._watch, name="watchdog",
+                         daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.busy.set()
+        self.idle.set()
+        if self.dispatcher is not None:
+            QtCore.QCoreApplication.instance().removeEventFilter(self)
+            self.dispatcher.aboutToBlock.disconnect(self._about_to_block)
+            self.dispatcher = None
+
+    def eventFilter(self, obj: QtCore.QObject, event: QtCore.QEvent) -> bool:
+        """ Called for every event, marks the first one after the loop was idle"""
+        if not self.busy.is_set():
+            self.busy_since = time.monotonic()
+            self.idle.clear()
+            self.busy.set()
+        return False
+
+    def _about_to_block(self):
+        self.busy.clear()
+        self.idle.set()
+
+    def _stack(self) -> str:
+        frame = sys._current_frames().get(self.main_thread)
+        return "".join(traceback.format_stack(frame)) if frame else ""
+
+    def _watch(self):
+        while True:
+            self.busy.wait()
+            if self.stop_event.is_set():
+                return
+            if self.idle.wait(self.threshold):
+                continue
+            # Captured while the main thread is still blocked
+            stack = self._stack()
+            since = self.busy_since
+            if not self.idle.wait(LONG_STALL - self.threshold):
+                logger.warning(
+                    f"Qt main thread blocked for over {LONG_STALL} s:\n{stack}")
+                self.idle.wait()
+            if self.stop_event.is_set():
+                return
+            logger.warning(
+                f"Qt main thread was blocked for {time.monotonic() - since:.2f} s:\n{stack}"
+            )
@@ -1,23 +1,142 @@
 import asyncio
-import json
 import threading
+import time
+import urllib.parse
+import uuid
+from collections import deque
+from typing import (Any, Deque, Dict, FrozenSet, Iterable, List, Optional,
+                    Tuple, Union)
 
 import websockets
 from websockets.legacy.server import serve as websockets_serve
 
+import overlay.delta as delta
+import overlay.json_codec as json_codec
 from overlay.logging_func import get_logger
+from overlay.static_files import StaticFiles
 
 lock = threading.Lock()
 logger = get_logger(__name__)
 
 
+def state_key(message: Dict[str, Any]) -> str:
+    """ Returns the key under which the latest message of its kind is kept"""
+    if 'profile_id' in message:
+        return f"{message['type']}/{message['profile_id']}"
+    return message['type']
+
+
+def parse_topics(
+        topics: Union[str, Iterable[str], None]) -> Optional[FrozenSet[str]]:
+    """ Returns topics from a comma separated string or a list, `None` for all topics"""
+    if isinstance(topics, str):
+        topics = topics.split(',')
+    if topics is None:
+        return None
+    topics = frozenset(topic.strip() for topic in topics if topic.strip())
+    return topics or None
+
+
+def matches(key: str, topics: Optional[FrozenSet[str]]) -> bool:
+    """ Whether a message with given key belongs to one of the topics.
+    A topic is a key (`profile_data/<profile_id>`) or its type (`profile_data`)."""
+    return topics is None or key in topics or key.split('/')[0] in topics
+
+
+class Client:
+    """ Connected websocket client and its health"""
+    def __init__(self, websocket: websockets.legacy.server.WebSocketServerProtocol,
+                 topics: Optional[FrozenSet[str]], use_delta: bool):
+        self.websocket = websocket
+        address = websocket.remote_address
+        self.name = f"{address[0]}:{address[1]}" if address else "?"
+        self.topics = topics
+        self.use_delta = use_delta
+        self.connected = time.time()
+        self.sent = 0  # Sequence number of the last message handled
+        self.messages = 0
+        self.bytes_sent = 0
+        self.drops = 0  # Superseded messages that were never sent
+        self.rtt: Optional[float] = None  # Ping round trip (seconds)
+
+    def info(self, seq: int) -> Dict[str, Any]:
+        """ Returns client stats, `seq` is the sequence number of the last message"""
+        return {
+            "name": self.name,
+            "topics": ",".join(sorted(self.topics)) if self.topics else "all",
+            "connected": time.time() - self.connected,
+            "lag": seq - self.sent,
+            "messages": self.messages,
+            "bytes": self.bytes_sent,
+            "drops": self.drops,
+            "rtt": self.rtt,
+        }
+
+
+def coalesce(messages: List[Tuple[int, str, str, str]],
+             client: Client) -> Tuple[List[str], int]:
+    """ Returns messages to send to the client and the number of dropped ones.
+    Only the latest message of each key is sent, as a full message if a delta before
+    it was dropped (the client couldn't apply it)."""
+    latest: Dict[str, int] = {}
+    for index, (_, key, _, _) in enumerate(messages):
+        if key and not matches(key, client.topics):
+            continue
+        latest[key] = index
+
+    result = []
+    dropped = 0
+    for key, index in sorted(latest.items(), key=lambda item: item[1]):
+        _, _, full, changes = messages[index]
+        superseded = sum(1 for _, other, _, _ in messages[:index]
+                         if other == key)
+        dropped += superseded
+        result.append(changes if client.use_delta and not superseded else full)
+    return result, dropped
+
+
 class Websocket_manager():
-    """ Class managing connection through a websocket to the HTML file"""
-    def __init__(self, port: int):
-        self.overlay_messages = []
+    """ Class managing connection through a websocket to the HTML file
+
+    Messages are pushed to the event loop and clients are woken up only when there is a new one.
+    Only the latest message of each kind (`state`) and a few recent messages are kept.
+
+    Each message carries a sequence number (`seq`). A reconnecting client passes the last
+    one it got (`?since=<seq>&session=<session>`) and receives only the messages it missed.
+
+    Clients connecting with `?delta=1` get only changes to the previous message of the same
+    kind (`delta` instead of `data`, see `overlay.delta`). Snapshots always contain full data.
+
+    Clients can subscribe to topics (see `matches`) with `?topics=color,player_data`
+    or a `{"type": "subscribe", "topics": [...]}` message, and get only matching messages.
+
+    Each client is served by its own coroutine, so a slow client never delays the others.
+    When it falls behind, superseded messages of the same kind are dropped (see `coalesce`)."""
+    def __init__(self, port: int, history: int = 20,
+                 ping_interval: float = 10):
         self.port = port
+        self.ping_interval = ping_interval
+        self.clients: Dict[int, Client] = {}
+        # The overlay page itself is served over HTTP on the same port
+        self.static_files = StaticFiles()
+        # Latest message for each key (e.g. `color`, `player_data`)
+        self.state: Dict[str, str] = {}
+        # Recent messages as (sequence number, key, full message, delta message) for clients catching up
+        self.recent: Deque[Tuple[int, str, str, str]] = deque(maxlen=history)
+        # Latest message (without `seq`) and its data for each key, to compute deltas against
+        self.sent: Dict[str, str] = {}
+        self.data: Dict[str, Any] = {}
+        self.seq = 0  # Sequence number of the last message
+        # Sequence numbers are valid only within one session (app run)
+        self.session = uuid.uuid4().hex[:8]
+        # Snapshots for each set of topics, until the next message
+        self._snapshots: Dict[Optional[FrozenSet[str]], str] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Set when a new message is published, then replaced with a new event
+        self.new_message: Optional[asyncio.Event] = None
 
     def run(self):
+        """ Runs the server in its own thread (see `serve` for an existing event loop)"""
         self.thread_server = threading.Thread(target=self._start_manager,
                                               daemon=True)
         self.thread_server.start()
@@ -26,61 +145,196 @@ class Websocket_manager():
         try:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            start_server = websockets_serve(self.manager, 'localhost',
-                                            self.port)
-            loop.run_until_complete(start_server)
+            loop.run_until_complete(self.serve())
             loop.run_forever()
         except Exception:
             logger.exception("Failed to start manager")
 
+    async def serve(self):
+        """ Starts the server in the running event loop"""
+        self.new_message = asyncio.Event()
+        await websockets_serve(
+            self.manager,
+            'localhost',
+            self.port,
+            process_request=self.static_files.process_request)
+        with lock:
+            self.loop = asyncio.get_running_loop()
+
     @staticmethod
-    async def _send_ws_message(
-            websocket: websockets.legacy.server.WebSocketServerProtocol,
-            message):
-        message = json.dumps(message)
-        await asyncio.wait_for(asyncio.gather(websocket.send(message)),
-                               timeout=1)
+    async def _send_ws_message(client: Client, message: str):
+        await client.websocket.send(message)
+        client.messages += 1
+        client.bytes_sent += len(message.encode('utf-8'))
+
+    async def _measure_rtt(self, client: Client):
+        """ Pings the client regularly and keeps the round trip time.
+        Dead connections are closed by the websockets keepalive."""
+        try:
+            while True:
+                await asyncio.sleep(self.ping_interval)
+                start = time.perf_counter()
+                pong = await client.websocket.ping()
+                try:
+                    await asyncio.wait_for(pong, timeout=self.ping_interval)
+                except asyncio.TimeoutError:
+                    continue
+                client.rtt = time.perf_counter() - start
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def clients_info(self) -> List[Dict[str, Any]]:
+        """ Returns stats of connected clients, see `Client.info`"""
+        return [client.info(self.seq) for client in list(self.clients.values())]
+
+    def snapshot(self, topics: Optional[FrozenSet[str]] = None) -> str:
+        """ Returns a message containing the latest message of each kind (matching `topics`)"""
+        if topics not in self._snapshots:
+            self._snapshots[topics] = (
+                f'{{"type":"snapshot","seq":{self.seq},"session":"{self.session}",'
+                '"data":[' + ','.join(message
+                                      for key, message in self.state.items()
+                                      if matches(key, topics)) + ']}')
+        return self._snapshots[topics]
+
+    def missed_messages(self, sent: int) -> Optional[List[Tuple[int, str, str, str]]]:
+        """ Returns messages after sequence number `sent`.
+        Returns `None` if some of them are no longer kept."""
+        missing = self.seq - sent
+        if missing > len(self.recent):
+            return None
+        return list(self.recent)[len(self.recent) - missing:]
+
+    def resume_from(self, query: Dict[str, List[str]]) -> Optional[int]:
+        """ Returns the sequence number a reconnecting client has seen
+        (`/?since=<seq>&session=<session>`), if it can be resumed"""
+        try:
+            since = int(query['since'][0])
+        except (KeyError, ValueError):
+            return None
+        if query.get('session', [None])[0] != self.session or since > self.seq:
+            return None
+        return since
 
     async def manager(
             self, websocket: websockets.legacy.server.WebSocketServerProtocol,
             path: str):
         """ Manages websocket connection for each client """
         logger.info(f"Opening: {websocket}")
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        received = asyncio.ensure_future(websocket.recv())
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        client = Client(websocket,
+                        parse_topics(query.get('topics', [None])[0]),
+                        query.get('delta') == ['1'])
+        self.clients[id(client)] = client
+        pinging = asyncio.ensure_future(self._measure_rtt(client))
+
+        try:
+            sent = self.resume_from(query)
+            if sent is None or self.missed_messages(sent) is None:
+                # Send the current state at once
+                client.sent = self.seq
+                await self._send_ws_message(client,
+                                            self.snapshot(client.topics))
+            else:
+                logger.info(f"Resuming client from #{sent}")
+                client.sent = sent
 
-        # Send the first one (init) and last one message if there is one
-        if self.overlay_messages:
-            await self._send_ws_message(websocket, self.overlay_messages[0])
-            if self.overlay_messages[0] != self.overlay_messages[-1]:
-                await self._send_ws_message(websocket,
-                                            self.overlay_messages[-1])
+            while not closed.done():
+                if received.done():
+                    # Subscribe frame `{"type": "subscribe", "topics": [...]}`
+                    try:
+                        message = json_codec.loads(received.result())
+                    except json_codec.JSONDecodeError:
+                        message = None
+                    received = asyncio.ensure_future(websocket.recv())
+                    if isinstance(message, dict) and message.get(
+                            'type') == 'subscribe':
+                        client.topics = parse_topics(message.get('topics'))
+                        client.sent = self.seq
+                        await self._send_ws_message(
+                            client, self.snapshot(client.topics))
 
-        sent = len(self.overlay_messages)
+                missed = self.missed_messages(client.sent)
+                if missed is None:
+                    logger.info("Client fell behind, sending a snapshot")
+                    client.drops += self.seq - client.sent
+                    messages = [self.snapshot(client.topics)]
+                else:
+                    messages, dropped = coalesce(missed, client)
+                    client.drops += dropped
+                client.sent = self.seq
 
-        while True:
-            try:
-                if len(self.overlay_messages) == sent:
+                # Messages published meanwhile are handled in the next round
+                for message in messages:
+                    await self._send_ws_message(client, message)
+
+                if client.sent != self.seq:
                     continue
-                await self._send_ws_message(websocket,
-                                            self.overlay_messages[sent])
-                sent += 1
-
-            except asyncio.TimeoutError:
-                logger.warning(f'#{sent-1} message was timed-out.')
-            except websockets.exceptions.ConnectionClosedOK:
-                logger.warning('Websocket connection closed (ok).')
-                break
-            except websockets.exceptions.ConnectionClosedError:
-                logger.warning('Websocket connection closed (error).')
-                break
-            except websockets.exceptions.ConnectionClosed:
-                logger.warning('Websocket connection closed.')
-                break
-            except Exception:
-                logger.exception("")
-            finally:
-                await asyncio.sleep(0.1)
-
-    def send(self, message):
-        """ Send message throught a websocket """
+
+                # Wait for a new message, a message from the client or the connection closing
+                new_message = asyncio.ensure_future(self.new_message.wait())
+                await asyncio.wait((new_message, received, closed),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                new_message.cancel()
+
+        except websockets.exceptions.ConnectionClosedOK:
+            logger.warning('Websocket connection closed (ok).')
+        except websockets.exceptions.ConnectionClosedError:
+            logger.warning('Websocket connection closed (error).')
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning('Websocket connection closed.')
+        except Exception:
+            logger.exception("")
+        finally:
+            closed.cancel()
+            received.cancel()
+            pinging.cancel()
+            del self.clients[id(client)]
+
+    def _store(self, key: str, full: str, changes: str):
+        self.seq += 1
+        full = f'{{"seq":{self.seq},' + full[1:]
+        changes = f'{{"seq":{self.seq},' + changes[1:]
+        self.recent.append((self.seq, key, full, changes))
+        self.state[key] = full
+        self._snapshots.clear()
+
+    def _publish(self, key: str, full: str, changes: str):
+        """ Stores the message and wakes up clients (runs in the event loop)"""
+        self._store(key, full, changes)
+        self.new_message.set()
+        self.new_message = asyncio.Event()
+
+    def send(self, message: Dict[str, Any]):
+        """ Send message throught a websocket (serialized once for all clients).
+        Thread-safe, the message is handed over to the event loop.
+
+        Messages that don't change the data of their kind are skipped."""
+        key = state_key(message)
+        full = json_codec.dumps(message)
         with lock:
-            self.overlay_messages.append(message)
+            if self.sent.get(key) == full:
+                return
+            self.sent[key] = full
+            changes = full
+            if 'data' in message:
+                # Decoded copy, the caller might modify the data later
+                data = json_codec.loads(full)['data']
+                patch = delta.diff(self.data[key], data) if key in self.data else None
+                if patch is not None:
+                    delta_message = {k: v for k, v in message.items() if k != 'data'}
+                    delta_message['delta'] = patch
+                    delta_text = json_codec.dumps(delta_message)
+                    if len(delta_text) < len(full):
+                        changes = delta_text
+                self.data[key] = data
+
+            if self.loop is None:
+                # The server isn't running yet, there are no clients to wake up
+                self._store(key, full, changes)
+            else:
+                self.loop.call_soon_threadsafe(self._publish, key, full,
+                                               changes)
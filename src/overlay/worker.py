@@ -1,15 +1,34 @@
 import sys
+import threading
+import time
 import traceback
-from typing import Callable, Optional
+from collections import defaultdict
+from functools import partial
+from typing import Any, Callable, Dict, Optional
 
 from PyQt5 import QtCore
 
+from overlay.http_client import LatencyMetrics
 from overlay.logging_func import get_logger
 
 logger = get_logger(__name__)
 
 THREADPOOL = QtCore.QThreadPool()
 
+# Priority lanes, jobs started by the user run before background ones
+BACKGROUND = 0
+USER = 10
+
+# Pending or running jobs by their key
+_jobs: Dict[str, "Worker"] = {}
+
+# Time jobs spent waiting in the queue and running, by function name
+queue_metrics = LatencyMetrics()
+run_metrics = LatencyMetrics()
+_stats_lock = threading.Lock()
+_queued = 0
+_cancelled: Dict[str, int] = defaultdict(int)
+
 
 class WorkerSignals(QtCore.QObject):
     '''
@@ -47,16 +66,43 @@ class Worker(QtCore.QRunnable):
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
+        self.name = getattr(fn, "__name__", type(fn).__name__)
+        self.enqueued = time.perf_counter()
+        # Set when the job is superseded, its results are then dropped
+        self.cancel_token = threading.Event()
 
         if 'progress_callback' in kwargs:
             self.kwargs['progress_callback'] = self.signals.progress
+        if 'cancel_token' in kwargs:
+            self.kwargs['cancel_token'] = self.cancel_token
+
+    def cancel(self):
+        """ Cancels the job. It's removed from the queue if it hasn't started yet."""
+        self.cancel_token.set()
+        if THREADPOOL.tryTake(self):
+            _dequeued()
+        with _stats_lock:
+            _cancelled[self.name] += 1
+
+    def unless_cancelled(self, callback: Callable) -> Callable:
+        """ Wraps the callback so it isn't called once the job is cancelled"""
+        def wrapper(*args):
+            if not self.cancel_token.is_set():
+                callback(*args)
+
+        return wrapper
 
     @QtCore.pyqtSlot()
     def run(self):
         """ Runs the function and emits signals (error, result, finished) """
+        _dequeued()
+        start = time.perf_counter()
+        queue_metrics.record(self.name, start - self.enqueued, True)
+        ok = False
         try:
             try:
                 result = self.fn(*self.args, **self.kwargs)
+                ok = True
             except Exception:
                 logger.exception("")
                 exctype, value = sys.exc_info()[:2]
@@ -65,6 +111,7 @@ class Worker(QtCore.QRunnable):
             else:
                 self.signals.result.emit(result)
             finally:
+                run_metrics.record(self.name, time.perf_counter() - start, ok)
                 self.signals.finished.emit()
         except RuntimeError:
             logger.exception('Error with pyqt thread. The app likely closed.')
@@ -72,13 +119,106 @@ class Worker(QtCore.QRunnable):
             logger.exception("")
 
 
-def scheldule(result_callback: Callable,
+def scheldule(result_callback: Optional[Callable],
               worker_function: Callable,
               *args,
-              error_callback: Optional[Callable] = None):
-    """ Scheldules work on the worker function and passes the result to the callback function"""
-    thread = Worker(worker_function, *args)
-    thread.signals.result.connect(result_callback)
+              error_callback: Optional[Callable] = None,
+              progress_callback: Optional[Callable] = None,
+              key: Optional[str] = None,
+              priority: int = BACKGROUND,
+              cancellable: bool = False) -> Worker:
+    """ Scheldules work on the worker function and passes the result to the callback function (if any)
+
+    If `progress_callback` is provided, the worker function receives `progress_callback`
+    keyword argument with a signal whose emitted values are passed to the callback.
+
+    A job with a `key` replaces the pending or running job with the same key. The replaced
+    job is cancelled and its results are dropped. With `cancellable`, the worker function
+    receives `cancel_token` keyword argument (`threading.Event`) to stop early.
+
+    Jobs with higher `priority` (`USER`) are started before `BACKGROUND` jobs."""
+    kwargs = {}
+    if progress_callback is not None:
+        kwargs['progress_callback'] = None
+    if cancellable:
+        kwargs['cancel_token'] = None
+    thread = Worker(worker_function, *args, **kwargs)
+
+    if progress_callback is not None:
+        thread.signals.progress.connect(
+            thread.unless_cancelled(progress_callback))
+    if result_callback is not None:
+        thread.signals.result.connect(thread.unless_cancelled(result_callback))
     if error_callback is not None:
-        thread.signals.error.connect(error_callback)
-    THREADPOOL.start(thread)
\ No newline at end of file
+        thread.signals.error.connect(thread.unless_cancelled(error_callback))
+
+    if key is not None:
+        cancel_job(key)
+        _jobs[key] = thread
+        thread.signals.finished.connect(partial(_job_finished, key, thread))
+    _enqueued()
+    THREADPOOL.start(thread, priority)
+    return thread
+
+
+def cancel_job(key: str):
+    """ Cancels the pending or running job with given key, its results are dropped"""
+    if key in _jobs:
+        logger.info(f"Cancelling job: {key}")
+        _jobs.pop(key).cancel()
+
+
+def _job_finished(key: str, thread: Worker):
+    if _jobs.get(key) is thread:
+        del _jobs[key]
+
+
+def _enqueued():
+    global _queued
+    with _stats_lock:
+        _queued += 1
+
+
+def _dequeued():
+    global _queued
+    with _stats_lock:
+        _queued -= 1
+
+
+def pool_status() -> Dict[str, int]:
+    """ Returns the number of busy and all threads of the pool and of queued jobs"""
+    return {
+        "busy": THREADPOOL.activeThreadCount(),
+        "threads": THREADPOOL.maxThreadCount(),
+        "queued": _queued
+    }
+
+
+def job_summary() -> Dict[str, Dict[str, Any]]:
+    """ Returns runs, errors, cancellations and queue and run time percentiles (ms)
+    for each worker function"""
+    runs = run_metrics.summary()
+    # Taken after runs, so every function that ran has its queue time
+    queued = queue_metrics.summary()
+    result = {}
+    for name, data in runs.items():
+        result[name] = {
+            "runs": data['requests'],
+            "errors": data['errors'],
+            "cancelled": _cancelled.get(name, 0),
+            "queue_p50": queued[name]['p50'],
+            "queue_p95": queued[name]['p95'],
+            "p50": data['p50'],
+            "p95": data['p95'],
+            "max": data['max'],
+        }
+    return result
+
+
+def log_summary():
+    for name, data in job_summary().items():
+        logger.info(
+            f"{name}: {data['runs']} runs ({data['errors']} errors, {data['cancelled']} cancelled) | "
+            f"queued p50 {data['queue_p50']:.0f} ms, p95 {data['queue_p95']:.0f} ms | "
+            f"run p50 {data['p50']:.0f} ms, p95 {data['p95']:.0f} ms, max {data['max']:.0f} ms"
+        )
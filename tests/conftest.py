@@ -0,0 +1,8 @@
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "src")
+sys.path.insert(0, SRC)
+# Paths to `html/` and `img/` are resolved from the script location
+sys.argv[0] = os.path.join(SRC, "AoE4_Overlay.py")
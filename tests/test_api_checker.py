@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+import overlay.http_client as http_client
+from overlay.api_checking import Api_checker
+from overlay.governor import Governor, RateLimited, ServiceUnavailable
+from overlay.settings import settings
+
+MAIN, WATCHED = 1, 2
+
+
+class Poller:
+    """ Runs `Api_checker.poll` in an event loop in a background thread"""
+
+    def __init__(self, checker: Api_checker, error: Exception = None):
+        self.checker = checker
+        self.error = error  # Raised by each check
+        self.checks = 0
+        self.checked = threading.Event()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        assert self.checked.wait(5)
+
+    def _run(self):
+        asyncio.run(self.checker.poll(self.run_blocking, self.report))
+        self.finished.set()
+
+    async def run_blocking(self, fn, *args):
+        self.checks += 1
+        self.checked.set()
+        if self.error is not None:
+            raise self.error
+
+    def report(self, name, data):
+        ...
+
+
+def test_stop_is_handled_immediately():
+    checker = Api_checker()
+    poller = Poller(checker)
+    time.sleep(0.1)  # Poller now sleeps until the next check
+    start = time.perf_counter()
+    checker.force_stop = True
+    assert poller.finished.wait(5)
+    # Used to take up to 0.5 s (polling `force_stop` on a tick)
+    assert time.perf_counter() - start < 0.05
+
+
+def test_forced_check_runs_immediately():
+    checker = Api_checker()
+    poller = Poller(checker)
+    time.sleep(0.1)
+    poller.checked.clear()
+    start = time.perf_counter()
+    checker.force_check = True
+    assert poller.checked.wait(5)
+    assert time.perf_counter() - start < 0.05
+    assert poller.checks == 2
+    checker.force_stop = True
+    assert poller.finished.wait(5)
+
+
+def test_polling_continues_after_an_error():
+    checker = Api_checker()
+    poller = Poller(checker, ValueError("Unexpected data"))
+    poller.checked.clear()
+    checker.force_check = True
+    assert poller.checked.wait(5)
+    assert poller.checks == 2
+    assert not poller.finished.is_set()
+    checker.force_stop = True
+    assert poller.finished.wait(5)
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    monkeypatch.setattr(settings, "profile_id", MAIN)
+    monkeypatch.setattr(settings, "watched_profiles", [WATCHED])
+
+
+def game(started: float):
+    return {"started_sec": started, "ongoing": True, "teams": []}
+
+
+def fail_watched_once(checker: Api_checker, monkeypatch, error: Exception):
+    """ The main profile has a new game, the watched profile fails in the first round"""
+    calls = {MAIN: 0, WATCHED: 0}
+
+    def get_last_game(profile_id):
+        calls[profile_id] += 1
+        if profile_id == WATCHED and calls[WATCHED] == 1:
+            raise error
+        return game(100)
+
+    monkeypatch.setattr(checker, "get_last_game", get_last_game)
+
+
+def test_main_game_returned_when_watched_profile_is_unavailable(
+        profiles, monkeypatch):
+    checker = Api_checker()
+    fail_watched_once(checker, monkeypatch,
+                      ServiceUnavailable("aoe4world.com", 10))
+    assert checker.get_data() == game(100)
+    assert checker.get_data() is None
+
+
+def test_main_game_kept_when_watched_profile_fails(profiles, monkeypatch):
+    checker = Api_checker()
+    fail_watched_once(checker, monkeypatch, ValueError("Unexpected data"))
+    with pytest.raises(ValueError):
+        checker.get_data()
+    # Not marked as shown, comes with the next round
+    assert checker.get_data() == game(100)
+    assert checker.get_data() is None
+
+
+def test_server_down_without_main_game(profiles, monkeypatch):
+    checker = Api_checker()
+
+    def get_last_game(profile_id):
+        raise ServiceUnavailable("aoe4world.com", 10)
+
+    monkeypatch.setattr(checker, "get_last_game", get_last_game)
+    assert checker.get_data() == {'server_down': True}
+
+
+def response(status_code: int, content: bytes) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = content
+    return resp
+
+
+@pytest.mark.parametrize("status_code, content", [
+    (503, b"<html><body>Service Unavailable</body></html>"),
+    (429, b'{"error": "Too many requests"}'),
+    (200, b"{}"),
+    (200, b'{"started_at": "yesterday", "kind": "rm_1v1"}'),
+])
+def test_last_game_ignores_error_responses(monkeypatch, status_code, content):
+    checker = Api_checker()
+    monkeypatch.setattr(http_client, "get",
+                        lambda *args, **kwargs: response(status_code, content))
+    assert checker.get_last_game(MAIN) is None
+    if status_code != 200:
+        assert not checker.body_hashes
+
+
+def test_last_game_is_parsed(monkeypatch):
+    checker = Api_checker()
+    content = b'{"started_at": "2022-11-20T18:42:03.000Z", "kind": "rm_1v1"}'
+    monkeypatch.setattr(http_client, "get",
+                        lambda *args, **kwargs: response(200, content))
+    data = checker.get_last_game(MAIN)
+    assert data['leaderboard_id'] == 17
+    assert data['started_sec'] == 1668969723
+
+
+def test_local_rate_limit_is_not_an_outage():
+    governor = Governor("example.com", rate=0.01, burst=1)
+    governor.before_request()
+    governor.bucket.acquire = lambda timeout: False
+    with pytest.raises(RateLimited):
+        governor.before_request()
+    assert governor.describe() == "ok"
+
+
+def test_local_rate_limit_ends_round_without_server_down(profiles, monkeypatch):
+    checker = Api_checker()
+
+    def get_last_game(profile_id):
+        raise RateLimited("aoe4world.com", 1)
+
+    monkeypatch.setattr(checker, "get_last_game", get_last_game)
+    assert checker.get_data() is None
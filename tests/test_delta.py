@@ -0,0 +1,128 @@
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from overlay.delta import diff
+
+MAIN_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "src", "html", "main.js")
+
+
+def apply_patch(old, patch):
+    """ Port of `apply_patch` in main.js, kept line by line the same"""
+    if "$set" in patch:
+        return patch["$set"]
+    if "$dict" in patch:
+        result = dict(old)
+        for key in patch.get("$del", []):
+            del result[key]
+        for key, value in patch["$dict"].items():
+            result[key] = apply_patch(result.get(key), value)
+        return result
+    result = old[:patch["$list"]]
+    for index, value in patch["items"].items():
+        index = int(index)
+        result.extend([None] * (index + 1 - len(result)))
+        result[index] = apply_patch(result[index], value)
+    return result
+
+
+def canonical(value) -> str:
+    """ Tells apart values Python considers equal (`True == 1`)"""
+    return json.dumps(value, sort_keys=True)
+
+
+# (old, new, expected patch)
+CASES = [
+    ({"a": 1, "b": 2}, {"a": 1, "b": 3}, {"$dict": {"b": {"$set": 3}}}),
+    ({"a": 1}, {"a": 1, "c": [1]}, {"$dict": {"c": {"$set": [1]}}}),
+    ({"a": 1, "b": 2}, {"a": 1}, {"$dict": {}, "$del": ["b"]}),
+    ({"a": {"x": 1, "y": 2}}, {"a": {"x": 1}},
+     {"$dict": {"a": {"$dict": {}, "$del": ["y"]}}}),
+    ([1, 2, 3], [1, 2], {"$list": 2, "items": {}}),
+    ([1, 2], [1, 5, 6], {"$list": 3, "items": {"1": {"$set": 5}, "2": {"$set": 6}}}),
+    ([{"a": 1}], [{"a": 2}],
+     {"$list": 1, "items": {"0": {"$dict": {"a": {"$set": 2}}}}}),
+    ({"a": [1]}, {"a": {"0": 1}}, {"$dict": {"a": {"$set": {"0": 1}}}}),
+    ({"a": 1}, {"a": "1"}, {"$dict": {"a": {"$set": "1"}}}),
+    ({"a": 1}, {"a": True}, {"$dict": {"a": {"$set": True}}}),
+    ({"a": None}, {"a": 0}, {"$dict": {"a": {"$set": 0}}}),
+    (1, [1], {"$set": [1]}),
+]
+
+
+@pytest.mark.parametrize("old, new, expected", CASES)
+def test_diff_produces_expected_patch(old, new, expected):
+    patch = diff(old, new)
+    assert canonical(patch) == canonical(expected)
+    assert canonical(apply_patch(copy.deepcopy(old), patch)) == canonical(new)
+
+
+def test_equal_values_have_no_patch():
+    data = {"players": [{"name": "A", "rating": "1400"}], "map": "Dry Arabia"}
+    assert diff(data, copy.deepcopy(data)) is None
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kinds = ["int", "str", "bool", "none"]
+    if depth < 3:
+        kinds += ["dict", "list"] * 2
+    kind = rng.choice(kinds)
+    if kind == "int":
+        return rng.randint(0, 3)
+    if kind == "str":
+        return rng.choice("abc")
+    if kind == "bool":
+        return rng.random() < 0.5
+    if kind == "none":
+        return None
+    if kind == "list":
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {
+        rng.choice("wxyz"): random_value(rng, depth + 1)
+        for _ in range(rng.randint(0, 4))
+    }
+
+
+def random_pairs(count: int):
+    rng = random.Random(14)
+    return [(random_value(rng), random_value(rng)) for _ in range(count)]
+
+
+def test_random_round_trips():
+    for old, new in random_pairs(2000):
+        patch = diff(old, new)
+        if patch is None:
+            assert canonical(old) == canonical(new)
+        else:
+            assert canonical(apply_patch(copy.deepcopy(old),
+                                         patch)) == canonical(new)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_main_js_applies_patches():
+    """ Runs `apply_patch` from main.js on the same cases"""
+    with open(MAIN_JS, encoding="utf-8") as f:
+        source = re.search(r"^function apply_patch\(.*?^}", f.read(),
+                           re.M | re.S).group(0)
+    pairs = [(old, new) for old, new, _ in CASES] + random_pairs(500)
+    cases = [(old, diff(old, new), new) for old, new in pairs
+             if diff(old, new) is not None]
+    script = source + """
+const cases = JSON.parse(require("fs").readFileSync(0, "utf-8"));
+const results = cases.map(([old, patch, _]) => apply_patch(old, patch));
+console.log(JSON.stringify(results));
+"""
+    output = subprocess.run(["node", "-e", script],
+                            input=json.dumps(cases),
+                            capture_output=True,
+                            text=True,
+                            check=True).stdout
+    assert [canonical(result) for result in json.loads(output)
+            ] == [canonical(new) for _, _, new in cases]
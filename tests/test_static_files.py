@@ -0,0 +1,33 @@
+import asyncio
+import http
+
+from websockets.datastructures import Headers
+
+from overlay.static_files import CACHED_MAX_AGE, StaticFiles
+
+
+def get(files: StaticFiles, path: str, **headers):
+    status, response_headers, body = asyncio.run(
+        files.process_request(path, Headers(**headers)))
+    return status, dict(response_headers), body
+
+
+def test_unversioned_files_are_revalidated():
+    files = StaticFiles()
+    for path in ("/html/jquery.min.js", "/img/aoe4_sword_shield.ico"):
+        status, headers, _ = get(files, path)
+        assert status == http.HTTPStatus.OK
+        assert headers["Cache-Control"] == f"max-age={CACHED_MAX_AGE}"
+        assert "immutable" not in headers["Cache-Control"]
+        status, _, body = get(files, path, **{"If-None-Match": headers["ETag"]})
+        assert status == http.HTTPStatus.NOT_MODIFIED
+        assert body == b""
+    status, headers, _ = get(files, "/html/overlay.html")
+    assert headers["Cache-Control"] == "no-cache"
+
+
+def test_files_outside_served_directories_are_not_found():
+    files = StaticFiles()
+    for path in ("/html/../overlay/settings.py", "/html/%2e%2e/AoE4_Overlay.py",
+                 "/settings.py", "/html/"):
+        assert get(files, path)[0] == http.HTTPStatus.NOT_FOUND
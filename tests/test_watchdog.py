@@ -0,0 +1,56 @@
+import logging
+import threading
+import time
+
+from PyQt5 import QtCore
+
+from overlay.watchdog import Watchdog
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def run_loop(seconds: float):
+    loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec_()
+
+
+def blocking_call():
+    time.sleep(0.4)
+
+
+def short_call():
+    time.sleep(0.05)
+
+
+def test_sub_second_stall_is_logged_with_stack(caplog):
+    watchdog = Watchdog(threshold=0.2)
+    watchdog.start()
+    try:
+        with caplog.at_level(logging.WARNING, logger="overlay.watchdog"):
+            QtCore.QTimer.singleShot(50, short_call)
+            QtCore.QTimer.singleShot(200, blocking_call)
+            run_loop(1)
+    finally:
+        watchdog.stop()
+    stalls = [r.getMessage() for r in caplog.records if "blocked" in r.getMessage()]
+    assert len(stalls) == 1
+    assert "blocking_call" in stalls[0]
+    duration = float(stalls[0].split(" for ")[1].split(" s")[0])
+    assert 0.35 < duration < 0.6
+
+
+def test_watchdog_waits_while_idle():
+    watchdog = Watchdog(threshold=0.2)
+    watchdog.start()
+    samples = []
+    sampler = threading.Timer(
+        0.3, lambda: samples.append(
+            (watchdog.busy.is_set(), watchdog.idle.is_set())))
+    try:
+        sampler.start()
+        run_loop(0.5)
+    finally:
+        watchdog.stop()
+    # The watchdog thread is blocked until the loop gets busy
+    assert samples == [(False, True)]
@@ -0,0 +1,110 @@
+import threading
+import time
+from functools import partial
+from typing import Callable
+
+from PyQt5 import QtCore
+
+from overlay import worker
+from overlay.api_checking import LOOKUP_EXECUTOR, Api_checker
+from overlay.runtime import Runtime, detect_wake
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+RUNTIME_WORKERS = 2
+LOOKUP_WORKERS = 4
+
+
+def all_threads_free(submit: Callable[[Callable], None], threads: int) -> bool:
+    """ Checks that `threads` tasks run at the same time (none of the threads is held)"""
+    barrier = threading.Barrier(threads + 1, timeout=2)
+    for _ in range(threads):
+        submit(barrier.wait)
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        return False
+    return True
+
+
+def test_threads_are_free_while_idle(monkeypatch):
+    """ Polling and wake detection wait in the event loop, not in any thread"""
+    checker = Api_checker()
+    checked = threading.Event()
+    monkeypatch.setattr(checker, "get_data",
+                        lambda callback: checked.set())
+    runtime = Runtime(blocking_workers=RUNTIME_WORKERS)
+    runtime.start()
+    try:
+        runtime.submit(checker.poll(runtime.run_blocking, runtime.emit))
+        runtime.submit(detect_wake(partial(runtime.emit, "woke")))
+        assert checked.wait(2)
+        time.sleep(0.2)  # Idle, waiting for the next check
+        assert all_threads_free(runtime.executor.submit, RUNTIME_WORKERS)
+        assert all_threads_free(LOOKUP_EXECUTOR.submit, LOOKUP_WORKERS)
+        assert all_threads_free(partial(worker.scheldule, None),
+                                worker.THREADPOOL.maxThreadCount())
+        assert worker.THREADPOOL.waitForDone(2000)
+        assert worker.pool_status()['queued'] == 0
+    finally:
+        checker.force_stop = True
+        runtime.stop()
+
+
+def test_pool_runs_jobs():
+    results = []
+    for i in range(worker.THREADPOOL.maxThreadCount() + 2):
+        worker.scheldule(results.append, time.sleep, 0.01)
+    assert worker.THREADPOOL.waitForDone(5000)
+    app.processEvents()
+    assert len(results) == worker.THREADPOOL.maxThreadCount() + 2
+    assert worker.pool_status()['busy'] == 0
+
+
+def test_keyed_job_replaces_queued_and_running_ones():
+    max_threads = worker.THREADPOOL.maxThreadCount()
+    worker.THREADPOOL.setMaxThreadCount(1)
+    try:
+        results = []
+        blocker = threading.Event()
+        started = threading.Event()
+
+        def running(value):
+            started.set()
+            blocker.wait(2)
+            return value
+
+        # Running job replaced by a queued one, which is replaced by another one
+        worker.scheldule(results.append, running, "running", key="job")
+        assert started.wait(2)
+        worker.scheldule(results.append, str, "queued", key="job")
+        assert worker.pool_status()['queued'] == 1
+        worker.scheldule(results.append, str, "newest", key="job")
+        assert worker.pool_status()['queued'] == 1
+        blocker.set()
+        assert worker.THREADPOOL.waitForDone(2000)
+        app.processEvents()
+        assert results == ["newest"]
+        assert worker.pool_status()['queued'] == 0
+        assert "job" not in worker._jobs
+    finally:
+        worker.THREADPOOL.setMaxThreadCount(max_threads)
+
+
+def test_cancelled_job_gets_cancel_token():
+    tokens = []
+
+    def job(cancel_token):
+        tokens.append(cancel_token)
+        return cancel_token.wait(2)
+
+    results = []
+    thread = worker.scheldule(results.append, job, cancellable=True)
+    while not tokens:
+        time.sleep(0.01)
+    worker.cancel_job("missing")  # Unknown keys are ignored
+    thread.cancel()
+    assert worker.THREADPOOL.waitForDone(2000)
+    app.processEvents()
+    assert tokens[0].is_set()
+    assert results == []